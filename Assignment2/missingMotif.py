@@ -10,8 +10,7 @@
 #          
 # Author: Mohammad Abdulqader (mabdulqa)
 #
-#   Notes: Zm4 genome computing time: 41 seconds
-#          A.platensis genome computing time: 121 seconds 
+#   Notes: Zm4 genome computing time: 1 second
 #                        
 ########################################################################
 
@@ -49,9 +48,27 @@ class CommandLine():
                                              prefix_chars = '-', 
                                              usage = '%(prog)s [options] -option1[default] <input >output' 
                                              )
-        self.parser.add_argument('--minMotif', type = int, choices = range(3, 9), action = 'store', default = 3, help = 'give an integer for motif minimum')
-        self.parser.add_argument('--maxMotif', type = int, choices = range(3, 9), action = 'store', default = 8, help = 'give an integer for motif maximum')
+        self.parser.add_argument('--minMotif', type = int, choices = range(3, 32), metavar = '{3..31}', action = 'store', default = 3, help = 'give an integer for motif minimum')
+        self.parser.add_argument('--maxMotif', type = int, choices = range(3, 32), metavar = '{3..31}', action = 'store', default = 8, help = 'give an integer for motif maximum')
         self.parser.add_argument('--cutoff', type = float, action = 'store', default = 0.0, help = 'give a Z-score cutoff')
+        self.parser.add_argument('--workers', type = int, action = 'store', default = 1, help = 'give an integer for counting processes')
+        self.parser.add_argument('--genomes', nargs = '+', action = 'store', default = None, help = 'give FastA files to compare in one motif by genome Z-score table')
+        self.parser.add_argument('--window', type = int, action = 'store', default = None, help = 'give a window size to score --motifs per window')
+        self.parser.add_argument('--step', type = int, action = 'store', default = None, help = 'give the step between windows, default the window size')
+        self.parser.add_argument('--motifs', action = 'store', default = None, help = 'give a comma separated list of motifs for --window, or for --sketch past size 12')
+        self.parser.add_argument('--sketch', action = 'store_true', help = 'count approximately in fixed memory with count-min sketches')
+        self.parser.add_argument('--epsilon', type = float, action = 'store', default = 1e-5, help = 'give the sketch error bound, as a fraction of all kmers')
+        self.parser.add_argument('--delta', type = float, action = 'store', default = 0.01, help = 'give the chance a sketch count is over its error bound')
+        self.parser.add_argument('--width', type = int, action = 'store', default = None, help = 'give the sketch width, overrides --epsilon')
+        self.parser.add_argument('--depth', type = int, action = 'store', default = None, help = 'give the sketch depth, overrides --delta')
+        self.parser.add_argument('--sparse', action = 'store_true', help = 'count into sparse tables, the default past --maxMotif 12')
+        self.parser.add_argument('--no-cache', dest = 'cache', action = 'store_false', help = 'always recount, do not use the count cache')
+        self.parser.add_argument('--cacheDir', action = 'store', default = None, help = 'give a directory for the count cache')
+        self.parser.add_argument('--cacheSize', type = float, action = 'store', default = 1024, help = 'give the count cache size cap in MB')
+        self.parser.add_argument('--fastq', action = 'store_true', help = 'read FastQ reads in place of FastA')
+        self.parser.add_argument('--trimQuality', type = int, action = 'store', default = 0, help = 'give a quality to trim FastQ read ends below')
+        self.parser.add_argument('--minQuality', type = float, action = 'store', default = 0, help = 'give the least mean quality of a FastQ read')
+        self.parser.add_argument('--minLength', type = int, action = 'store', default = 0, help = 'give the least length of a trimmed FastQ read')
         if inOpts is None :
             self.args = self.parser.parse_args()
         else :
@@ -69,6 +86,17 @@ class Usage(Exception):
 # FastAreader
 ########################################################################
 import sys
+import os
+import mmap
+import io
+import itertools
+import zlib
+import queue
+import threading
+import bisect
+import struct
+import collections
+from concurrent.futures import ThreadPoolExecutor
 class FastAreader:
     '''
     Define objects to read FastA files.
@@ -78,44 +106,1422 @@ class FastAreader:
     usage:
     for head, seq in thisReader.readFasta():
         print (head,seq)
+    for head, start, window, last in thisReader.readWindows(2**20, 30):
+        print (head, start, bytes(window))
+    for head, seq in thisReader.readParallel(4):
+        print (head,seq)
+    random access, through a .fai index beside the file:
+    thisReader.fetch('chr1:1001-2000')
+    gzip and BGZF (bgzip) input is inflated as it is read, and a BGZF
+    file can be fetched from too, through a .gzi block table beside it.
     '''
 
     def __init__(self, fname=''):
         '''contructor: saves attribute fname '''
         self.fname = fname
+        self.faIndex = None
+        self.faMap = None
+        self.faBlocks = None
+
+    # one bytes.translate call per block uppercases and strips whitespace
+    blockSize = 2**20
+    upperTable = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz', b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+    whitespace = b' \t\n\r\v\f'
+    # compressed input is inflated by these many threads, with at most
+    # queueSize inflated blocks waiting to be parsed
+    threads = min(4, os.cpu_count() or 1)
+    queueSize = 8
+    # readParallel gives each worker byte ranges of at most rangeSize
+    rangeSize = 2**26
+    gzipMagic = b'\x1f\x8b'
 
     def doOpen(self):
         ''' Handle file opens, allowing STDIN.'''
-        if self.fname is '':
+        if self.fname == '':
             return sys.stdin
         else:
             return open(self.fname)
 
-    def readFasta(self):
-        ''' Read an entire FastA record and return the sequence header/sequence'''
-        header = ''
-        sequence = ''
+    def doOpenBytes(self):
+        ''' Handle binary file opens, allowing STDIN.'''
+        if self.fname == '':
+            return sys.stdin.buffer
+        else:
+            return open(self.fname, 'rb')
+
+    def readBlocks(self):
+        ''' Yield the raw bytes of the input, a block at a time.
+
+        gzip input, told by its magic bytes, is inflated as it is read, so
+        inflation overlaps the parsing of the blocks already given out. A
+        BGZF file is inflated by a pool of threads, other gzip by one
+        background thread.
+        '''
+        with self.doOpenBytes() as fileH:
+            head = self.readExactly(fileH, 18)
+            kind = self.kindOf(head)
+            if kind == 'bgzf':
+                yield from self.inflateBgzf(fileH, head)
+                return
+            if kind == 'gzip':
+                yield from self.inflateGzip(fileH, head)
+                return
+            block = head
+            while block:
+                yield block
+                block = fileH.read(self.blockSize)
+
+    @staticmethod
+    def readExactly(fileH, size):
+        ''' Read size bytes, fewer only at the end of the file. '''
+        data = fileH.read(size)
+        while 0 < len(data) < size:
+            more = fileH.read(size - len(data))
+            if not more:
+                break
+            data += more
+        return data
+
+    @classmethod
+    def kindOf(cls, head):
+        ''' Return 'bgzf', 'gzip' or None from the first 18 bytes of a file. '''
+        if not head.startswith(cls.gzipMagic):
+            return None
+        return 'bgzf' if cls.bgzfSize(head) is not None else 'gzip'
+
+    @staticmethod
+    def bgzfSize(header):
+        ''' Return the size of the BGZF block with this 18 byte header, None if it is not one. '''
+        if len(header) < 18 or header[:4] != b'\x1f\x8b\x08\x04' or \
+           header[10:16] != b'\x06\x00BC\x02\x00':
+            return None
+        return int.from_bytes(header[16:18], 'little') + 1
+
+    @classmethod
+    def bgzfBlocks(cls, fileH, head=b''):
+        ''' Yield the compressed bytes of each BGZF block of a file. '''
+        header = head + cls.readExactly(fileH, 18 - len(head))
+        while header:
+            size = cls.bgzfSize(header)
+            if size is None:
+                raise ValueError('{} is not a BGZF block'.format(header[:18]))
+            block = header + cls.readExactly(fileH, size - 18)
+            if len(block) < size:
+                raise EOFError('the BGZF file ends inside a block')
+            yield block
+            header = cls.readExactly(fileH, 18)
+
+    @staticmethod
+    def inflateMembers(blocks):
+        ''' Inflate a list of gzip members, such as BGZF blocks, and join them. '''
+        return b''.join(zlib.decompress(block, 31) for block in blocks)
+
+    def inflateBgzf(self, fileH, head):
+        ''' Yield the inflated bytes of a BGZF file, inflating its blocks in parallel.
+
+        The blocks are handed out in tasks of about blockSize inflated
+        bytes and at most twice as many tasks as threads are in flight.
+        zlib lets go of the GIL, so the threads inflate side by side.
+        '''
+        perTask = max(1, self.blockSize >> 16) # a BGZF block holds at most 64 KB
+        with ThreadPoolExecutor(self.threads) as pool:
+            pending = collections.deque()
+            batch = []
+            for block in self.bgzfBlocks(fileH, head):
+                batch.append(block)
+                if len(batch) == perTask:
+                    pending.append(pool.submit(self.inflateMembers, batch))
+                    batch = []
+                while len(pending) > 2 * self.threads:
+                    data = pending.popleft().result()
+                    if data:
+                        yield data
+            if batch:
+                pending.append(pool.submit(self.inflateMembers, batch))
+            while pending:
+                data = pending.popleft().result()
+                if data:
+                    yield data
+
+    def inflateGzip(self, fileH, head):
+        ''' Yield the inflated bytes of a gzip file, inflated by a background thread.
+
+        The thread reads and inflates ahead into a queue of queueSize
+        blocks. A file of several gzip members, as from cat, is read whole.
+        '''
+        blocks = queue.Queue(self.queueSize)
+        stop = threading.Event()
+
+        def put(item):
+            ''' Queue an item unless the reader has stopped. '''
+            while not stop.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def inflate():
+            ''' Inflate the file into the queue, then queue None or the error. '''
+            try:
+                inflater = zlib.decompressobj(31)
+                inMember = False
+                data = head
+                while data and not stop.is_set():
+                    while data:
+                        inMember = True
+                        inflated = inflater.decompress(data)
+                        if inflated:
+                            put(inflated)
+                        data = b''
+                        if inflater.eof:
+                            # the next member starts after the end of this one
+                            data = inflater.unused_data
+                            inflater = zlib.decompressobj(31)
+                            inMember = False
+                    data = fileH.read(self.blockSize)
+                if inMember:
+                    raise EOFError('the gzip file ends inside a member')
+                put(None)
+            except Exception as error:
+                put(error)
+
+        thread = threading.Thread(target=inflate, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = blocks.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
+    def readPieces(self, blocks=None):
+        ''' Yield (record number, header, piece) for the cleaned sequence of each record
+
+        The input is read in large blocks. Each piece of sequence is cleaned
+        with a single bytes.translate, so a record arrives as one or more
+        pieces of at most a block. Every record starts with an empty piece,
+        so records without sequence are still seen. blocks, when given, are
+        parsed in place of the input.
+        '''
+        number = -1
+        header = None # None until the first fasta header
+        headerLine = bytearray()
+        inHeader = False
+        atLineStart = True
+
+        for block in self.readBlocks() if blocks is None else blocks:
+            pos = 0
+            while pos < len(block):
+                if inHeader:
+                    end = block.find(b'\n', pos)
+                    if end < 0:
+                        headerLine += block[pos:]
+                        break
+                    headerLine += block[pos:end]
+                    header = headerLine.decode().rstrip()
+                    number += 1
+                    yield number, header, b''
+                    inHeader, atLineStart = False, True
+                    pos = end + 1
+                elif atLineStart and block.startswith(b'>', pos):
+                    headerLine = bytearray()
+                    inHeader = True
+                    pos += 1
+                else:
+                    # sequence runs to the next line that starts a header
+                    end = block.find(b'\n>', pos)
+                    end = len(block) if end < 0 else end + 1
+                    if header is not None:
+                        yield number, header, block[pos:end].translate(self.upperTable, self.whitespace)
+                    atLineStart = block[end - 1] == ord('\n')
+                    pos = end
+
+        if inHeader:
+            yield number + 1, headerLine.decode().rstrip(), b''
+
+    def readFasta(self, blocks=None):
+        ''' Read an entire FastA record and return the sequence header/sequence
+
+        The pieces of a record are added to a bytearray, which is decoded
+        once per record.
+        '''
+        for number, pieces in itertools.groupby(self.readPieces(blocks), key=lambda piece: piece[0]):
+            sequence = bytearray()
+            for number, header, piece in pieces:
+                sequence += piece
+            yield header, sequence.decode()
+
+    def readParallel(self, workers, ordered=True):
+        ''' Read the FastA records as readFasta does, parsing in worker processes.
+
+        The file is cut into byte ranges of at most rangeSize, at least one
+        per worker, and each cut is moved on to the next line that starts a
+        header. Each range is parsed by a worker, and its records come back
+        as a batch: in file order, or as soon as they are done if ordered is
+        False. At most two batches per worker are in flight. Input that
+        cannot be cut into ranges, a pipe or a gzip file, is read by
+        readFasta, as is any input when workers is 1 or less.
+        '''
+        path = self.seekablePath()
+        if workers <= 1 or path is None:
+            yield from self.readFasta()
+            return
+        import multiprocessing
+        start = os.lseek(sys.stdin.fileno(), 0, os.SEEK_CUR) if self.fname == '' else 0
+        mm = FastAreader(path).doMap()
+        size = len(mm)
+        ranges = max(workers, -(-(size - start) // self.rangeSize))
+        cuts = [start]
+        for i in range(1, ranges):
+            cut = start + (size - start) * i // ranges
+            cut = mm.find(b'\n>', max(cut - 1, cuts[-1])) + 1 or size
+            if cut > cuts[-1]:
+                cuts.append(cut)
+        cuts.append(size)
+        tasks = [(path, begin, end) for begin, end in zip(cuts, cuts[1:]) if end > begin]
+
+        finished = queue.Queue()
+        pending = collections.deque()
+
+        def collect():
+            ''' Return the oldest batch, or the first one done when not ordered. '''
+            job = pending.popleft()
+            if ordered:
+                return job.get()
+            batch = finished.get()
+            if isinstance(batch, BaseException):
+                raise batch
+            return batch
 
-        with self.doOpen() as fileH:
+        with multiprocessing.Pool(workers) as pool:
+            for task in tasks:
+                if len(pending) >= 2 * workers:
+                    yield from collect()
+                if ordered:
+                    pending.append(pool.apply_async(FastAreader.parseRange, (task,)))
+                else:
+                    pending.append(pool.apply_async(FastAreader.parseRange, (task,),
+                                                    callback=finished.put, error_callback=finished.put))
+            while pending:
+                yield from collect()
+
+    @staticmethod
+    def parseRange(task):
+        ''' Return the records of a (path, start, end) byte range, for readParallel. '''
+        path, start, end = task
+        reader = FastAreader(path)
+        mm = reader.doMap()
+        return list(reader.readFasta(mm[pos:min(pos + reader.blockSize, end)]
+                                     for pos in range(start, end, reader.blockSize)))
+
+    def seekablePath(self):
+        ''' Return a path the input can be mapped from, None for a pipe or gzip input.
+
+        stdin redirected from a file is found through /proc/self/fd.
+        '''
+        path = self.fname
+        if path == '':
+            try:
+                fd = sys.stdin.fileno()
+                path = os.readlink('/proc/self/fd/{}'.format(fd))
+                if not os.path.samestat(os.fstat(fd), os.stat(path)):
+                    return None
+            except (OSError, ValueError, AttributeError):
+                return None
+        if not os.path.isfile(path) or FastAreader(path).compression() is not None:
+            return None
+        return path
 
-            header = ''
-            sequence = ''
+    def readWindows(self, size, overlap=0):
+        ''' Yield (header, start, window, last) for overlapping windows of each record
 
-            # skip to first fasta header
-            line = fileH.readline()
-            while not line.startswith('>'):
-                line = fileH.readline()
-            header = line[1:].rstrip()
+        Windows hold size bases and start every size - overlap bases, so a
+        record is never held in memory as a whole. start is the 0-based
+        position of the window in its record and last marks the final
+        window of a record, which runs to the record end and may be shorter.
+        A window that lies inside one block of input is a memoryview of it,
+        one that spans two blocks is a bytes copy.
+        '''
+        if not 0 <= overlap < size:
+            raise ValueError('overlap must be at least 0 and less than size')
+        for number, pieces in itertools.groupby(self.readPieces(), key=lambda piece: piece[0]):
+            number, header, piece = next(pieces)
+            for start, window, last in self.windowPieces(
+                    (piece for number, header, piece in pieces), size, overlap):
+                yield header, start, window, last
 
-            for line in fileH:
-                if line.startswith('>'):
-                    yield header, sequence
-                    header = line[1:].rstrip()
-                    sequence = ''
+    @staticmethod
+    def windowPieces(pieces, size, overlap=0):
+        ''' Yield (start, window, last) for the windows over consecutive pieces of one sequence.
+
+        A window is only given out once the data reaches past its end, so
+        the window that reaches the end of the sequence is always the last.
+        '''
+        step = size - overlap
+        nextStart = 0 # position of the next window
+        tail = b'' # the sequence from nextStart to the start of piece
+        for piece in pieces:
+            if not piece:
+                continue
+            pieceStart = nextStart + len(tail)
+            pieceEnd = pieceStart + len(piece)
+            while nextStart + size < pieceEnd:
+                if nextStart >= pieceStart:
+                    offset = nextStart - pieceStart
+                    yield nextStart, memoryview(piece)[offset:offset + size], False
                 else:
-                    sequence += ''.join(line.rstrip().split()).upper()
+                    yield nextStart, tail + piece[:size - len(tail)], False
+                    tail = tail[step:]
+                nextStart += step
+            if nextStart >= pieceStart:
+                tail = piece[nextStart - pieceStart:]
+            else:
+                tail = tail + piece
+        yield nextStart, tail, True
+
+    def index(self):
+        ''' Return the record index, building the .fai sidecar if it is missing or stale.
+
+        The index maps each record name (the header up to the first space)
+        to (length, offset, lineBases, lineWidth) as in a samtools .fai:
+        the sequence length, the byte offset of its first base, the bases
+        per line and the bytes per line. The sidecar is a plain samtools
+        .fai, and one older than the FastA, or that does not fit it, is
+        rebuilt.
+        The offsets of a BGZF file are in its inflated bytes, as samtools
+        keeps them, and virtualOffset turns them into file positions.
+        '''
+        if self.fname == '':
+            raise ValueError('an index needs a FastA file, not stdin')
+        if self.faIndex is not None:
+            return self.faIndex
+        sidecar = self.fname + '.fai'
+        try:
+            if os.stat(sidecar).st_mtime_ns >= os.stat(self.fname).st_mtime_ns:
+                faIndex = dict()
+                with open(sidecar) as fileH:
+                    for line in fileH:
+                        name, length, offset, lineBases, lineWidth = line.rstrip('\n').split('\t')
+                        faIndex[name] = (int(length), int(offset), int(lineBases), int(lineWidth))
+                if self.indexFits(faIndex):
+                    self.faIndex = faIndex
+                    return self.faIndex
+        except (OSError, ValueError):
+            pass
+        self.faIndex = self.buildIndex()
+        try:
+            with open(sidecar, 'w') as fileH:
+                for name, entry in self.faIndex.items():
+                    fileH.write('\t'.join([name] + [str(value) for value in entry]) + '\n')
+        except OSError:
+            pass # a read only directory still gets an in memory index
+        return self.faIndex
+
+    def indexFits(self, faIndex):
+        ''' Check that every record of an index lies in the file and the last one ends it.
+
+        A FastA replaced by an older file keeps a newer .fai, so the
+        records are checked against the file as well as its mtime.
+        '''
+        size = self.dataSize()
+        if size is None:
+            return False
+        last = 0 # one past the last base of the last record
+        for length, offset, lineBases, lineWidth in faIndex.values():
+            end = offset
+            if length:
+                if lineBases <= 0 or lineWidth < lineBases:
+                    return False
+                lines = (length - 1) // lineBases # whole lines before the last
+                end = offset + lines * lineWidth + length - lines * lineBases
+            if end > size:
+                return False
+            last = max(last, end)
+        # only line ends may follow the last base
+        return size - last <= 1024 and not self.readRange(last, size).strip()
+
+    def buildIndex(self):
+        ''' Scan the FastA file for the offsets and line layout of every record. '''
+        import numpy as np
+        faIndex = dict()
+        kind = self.compression()
+        if kind == 'gzip':
+            raise ValueError('{} is gzip but not BGZF, recompress it with bgzip to index it'.format(self.fname))
+        mm = b''.join(self.readBlocks()) if kind == 'bgzf' else self.doMap()
+        if len(mm) == 0:
+            return faIndex
+        data = np.frombuffer(mm, dtype=np.uint8)
+        ends = np.flatnonzero(data == ord('\n')) + 1 # one past each line
+        if len(ends) == 0 or ends[-1] != len(data):
+            ends = np.append(ends, len(data))
+        starts = np.concatenate(([0], ends[:-1]))
+        widths = ends - starts
+        # bases on a line leave out its line end
+        bases = widths - (data[ends - 1] == ord('\n')) - \
+            ((widths > 1) & (data[np.maximum(ends - 2, 0)] == ord('\r')))
+        headers = np.flatnonzero(data[starts] == ord('>'))
+        for i, line in enumerate(headers.tolist()):
+            last = headers[i + 1] if i + 1 < len(headers) else len(starts)
+            header = bytes(mm[starts[line] + 1:starts[line] + bases[line]]).decode()
+            name = header.split()[0] if header.split() else header
+            lineBases, lineWidth = bases[line + 1:last], widths[line + 1:last]
+            if len(lineBases) == 0:
+                faIndex[name] = (0, int(ends[line]), 0, 0)
+                continue
+            if (len(lineBases) > 1 and ((lineBases[:-1] != lineBases[0]).any() or
+                                        (lineWidth[:-1] != lineWidth[0]).any()
+                                        or lineBases[-1] > lineBases[0])):
+                raise ValueError('record {} has uneven line lengths, it cannot be indexed'.format(name))
+            faIndex[name] = (int(lineBases.sum()), int(starts[line + 1]),
+                             int(lineBases[0]), int(lineWidth[0]))
+        return faIndex
+
+    def compression(self):
+        ''' Return 'bgzf', 'gzip' or None for the compression of the file. '''
+        with open(self.fname, 'rb') as fileH:
+            return self.kindOf(self.readExactly(fileH, 18))
+
+    def dataSize(self):
+        ''' Return the size of the file once inflated, None for gzip that is not BGZF. '''
+        kind = self.compression()
+        if kind is None:
+            return os.stat(self.fname).st_size
+        if kind == 'gzip':
+            return None
+        fileOffsets, inflatedOffsets = self.blockTable()
+        tail = self.tailSize(fileOffsets[-1])
+        return None if tail is None else inflatedOffsets[-1] + tail
 
-        yield header, sequence
+    def tailSize(self, fileOffset):
+        ''' Return the inflated size of the BGZF blocks from fileOffset to the end of the file.
+
+        None when the bytes from there are not whole blocks, or there are
+        none: a table offset always starts a block.
+        '''
+        try:
+            with open(self.fname, 'rb') as fileH:
+                fileH.seek(fileOffset)
+                sizes = [int.from_bytes(block[-4:], 'little') for block in self.bgzfBlocks(fileH)]
+        except (ValueError, EOFError):
+            return None
+        return sum(sizes) if sizes else None
+
+    def blockTable(self):
+        ''' Return the file and inflated offsets of the blocks of a BGZF file.
+
+        The table is kept beside the file in the .gzi layout of bgzip -i: a
+        count, then a (file offset, inflated offset) pair of little endian
+        64 bit integers for each block after the first. A .gzi older than
+        the file, or whose last block does not end the file, is rebuilt by
+        reading the block headers and sizes.
+        '''
+        if self.faBlocks is not None:
+            return self.faBlocks
+        sidecar = self.fname + '.gzi'
+        pairs = None
+        try:
+            if os.stat(sidecar).st_mtime_ns >= os.stat(self.fname).st_mtime_ns:
+                with open(sidecar, 'rb') as fileH:
+                    count, = struct.unpack('<Q', fileH.read(8))
+                    pairs = struct.unpack('<{}Q'.format(2 * count), fileH.read(16 * count))
+                if self.tailSize(pairs[-2] if pairs else 0) is None:
+                    pairs = None
+        except (OSError, struct.error):
+            pairs = None
+        if pairs is None:
+            pairs = []
+            fileOffset = inflatedOffset = 0
+            with open(self.fname, 'rb') as fileH:
+                for block in self.bgzfBlocks(fileH):
+                    fileOffset += len(block)
+                    inflatedOffset += int.from_bytes(block[-4:], 'little') # ISIZE
+                    pairs += [fileOffset, inflatedOffset]
+            pairs = pairs[:-2] # nothing starts after the last block
+            try:
+                with open(sidecar, 'wb') as fileH:
+                    fileH.write(struct.pack('<Q{}Q'.format(len(pairs)), len(pairs) // 2, *pairs))
+            except OSError:
+                pass
+        self.faBlocks = ([0] + list(pairs[0::2]), [0] + list(pairs[1::2]))
+        return self.faBlocks
+
+    def virtualOffset(self, offset):
+        ''' Return the BGZF virtual offset of an inflated offset.
+
+        This is the file offset of the block holding it, shifted up 16 bits,
+        plus the offset within the inflated block.
+        '''
+        fileOffsets, inflatedOffsets = self.blockTable()
+        block = bisect.bisect_right(inflatedOffsets, offset) - 1
+        return fileOffsets[block] << 16 | (offset - inflatedOffsets[block])
+
+    def readRange(self, start, end):
+        ''' Return the bytes from start up to end of the file, once inflated.
+
+        A BGZF file inflates only the blocks that hold the range.
+        '''
+        if self.compression() != 'bgzf':
+            return self.doMap()[start:end]
+        if end <= start:
+            return b''
+        fileOffsets, inflatedOffsets = self.blockTable()
+        virtual = self.virtualOffset(start)
+        last = bisect.bisect_right(inflatedOffsets, end - 1)
+        with open(self.fname, 'rb') as fileH:
+            fileH.seek(virtual >> 16)
+            if last < len(fileOffsets):
+                blocks = self.bgzfBlocks(io.BytesIO(fileH.read(fileOffsets[last] - (virtual >> 16))))
+            else:
+                blocks = self.bgzfBlocks(fileH)
+            data = self.inflateMembers(list(blocks))
+        within = virtual & 0xffff
+        return data[within:within + end - start]
+
+    def doMap(self):
+        ''' Memory map the FastA file, once. '''
+        if self.faMap is None:
+            with open(self.fname, 'rb') as fileH:
+                if os.fstat(fileH.fileno()).st_size == 0:
+                    return b''
+                self.faMap = mmap.mmap(fileH.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.faMap
+
+    def fetch(self, region):
+        ''' Return the sequence of a record name, or of a 'name:start-end' slice.
+
+        start and end are 1-based and inclusive, as in samtools faidx. Only
+        the bytes of the slice are read, found from the index with no scan.
+        '''
+        faIndex = self.index()
+        name, start, end = region, 1, None
+        if region not in faIndex and ':' in region:
+            name, span = region.rsplit(':', 1)
+            span = span.replace(',', '')
+            if '-' in span:
+                start, end = span.split('-', 1)
+                start, end = int(start), int(end) if end else None
+            else:
+                start = int(span)
+        if name not in faIndex:
+            raise KeyError(name)
+        length, offset, lineBases, lineWidth = faIndex[name]
+        end = length if end is None else min(end, length)
+        start = max(start, 1) - 1
+        if end <= start:
+            return ''
+
+        def byteOffset(position):
+            ''' File offset of a 0-based position in the record. '''
+            return offset + (position // lineBases) * lineWidth + position % lineBases
+
+        raw = self.readRange(byteOffset(start), byteOffset(end - 1) + 1)
+        return raw.translate(None, b'\r\n').decode().upper()
+
+########################################################################
+# FastQreader
+########################################################################
+import numpy as np
+
+class FastQreader:
+    '''
+    Define objects to read FastQ files, as FastAreader does FastA.
+
+    instantiation:
+    thisReader = FastQreader ('reads.fq', trimQuality=20, minQuality=25)
+    usage:
+    for head, seq in thisReader.readFastq():
+        print (head,seq)
+
+    Records are four lines: @header, sequence, + and the Phred+33
+    qualities. Each block of records is decoded as one NumPy array, the
+    ends of each read below trimQuality are trimmed and reads whose mean
+    quality is below minQuality, or that are shorter than minLength once
+    trimmed, are dropped. gzip input is read as by FastAreader.
+
+    attributes:
+    - fname: the file name, stdin if empty.
+    - trimQuality: trim the read ends below this quality, 0 for none.
+    - minQuality: the least mean quality of a read that is kept.
+    - minLength: the least length of a read that is kept.
+
+    The following functions are included in FastQreader class:
+    - readBatches: the kept (headers, sequences, qualities) of each block.
+    - readFastq: (header, sequence) for each kept read.
+    - readJoined: the kept reads of each block as one sequence.
+    '''
+    phredOffset = 33
+
+    def __init__(self, fname='', trimQuality=0, minQuality=0, minLength=0):
+        '''contructor: saves attribute fname and the filters '''
+        self.fname = fname
+        self.trimQuality = trimQuality
+        self.minQuality = minQuality
+        self.minLength = minLength
+
+    def readLines(self):
+        ''' Yield the lines of each block of whole records. '''
+        carry = b''
+        for block in FastAreader(self.fname).readBlocks():
+            lines = (carry + block).replace(b'\r', b'').split(b'\n')
+            whole = (len(lines) - 1) // 4 * 4 # the last line may not be done
+            carry = b'\n'.join(lines[whole:])
+            if whole:
+                yield lines[:whole]
+        lines = carry.split(b'\n')
+        while lines and not lines[-1]:
+            lines.pop()
+        if len(lines) % 4:
+            raise ValueError('the FastQ input ends inside a record')
+        if lines:
+            yield lines
+
+    def readBatches(self):
+        ''' Yield (headers, sequences, qualities) for the kept reads of each block.
+
+        Headers and sequences are str, sequences in upper case, and the
+        qualities are arrays of Phred scores for the trimmed reads.
+        '''
+        for lines in self.readLines():
+            headers, sequences, pluses, qualities = lines[0::4], lines[1::4], lines[2::4], lines[3::4]
+            if not all(head.startswith(b'@') for head in headers) or \
+               not all(plus.startswith(b'+') for plus in pluses):
+                raise ValueError('FastQ records need @header, sequence, + and quality lines')
+            lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+            if (lengths != np.fromiter(map(len, qualities), dtype=np.int64, count=len(qualities))).any():
+                raise ValueError('a FastQ sequence and its qualities differ in length')
+            phred = np.frombuffer(b''.join(qualities), dtype=np.uint8).astype(np.int64) - self.phredOffset
+            if len(phred) and phred.min() < 0:
+                raise ValueError('FastQ qualities are Phred+33, no lower than !')
+            ends = np.cumsum(lengths)
+            starts = ends - lengths
+
+            # keep from the first to the last base at or above trimQuality
+            good = np.flatnonzero(phred >= self.trimQuality)
+            first = np.searchsorted(good, starts)
+            last = np.searchsorted(good, ends) - 1
+            hasGood = last >= first
+            good = np.append(good, 0) # reads with no good base look past the end
+            keepStarts = np.where(hasGood, good[first], starts)
+            keepEnds = np.where(hasGood, good[np.maximum(last, 0)] + 1, starts)
+
+            total = np.concatenate(([0], np.cumsum(phred)))
+            keptLengths = keepEnds - keepStarts
+            means = (total[keepEnds] - total[keepStarts]) / np.maximum(keptLengths, 1)
+            kept = np.flatnonzero((keptLengths >= self.minLength) & (means >= self.minQuality))
+
+            upperTable = FastAreader.upperTable
+            yield ([headers[i][1:].decode().rstrip() for i in kept],
+                   [sequences[i][keepStarts[i] - starts[i]:keepEnds[i] - starts[i]].translate(upperTable).decode()
+                    for i in kept],
+                   [phred[keepStarts[i]:keepEnds[i]] for i in kept])
+
+    def readFastq(self):
+        ''' Yield (header, sequence) for each kept read, as readFasta does. '''
+        for headers, sequences, qualities in self.readBatches():
+            yield from zip(headers, sequences)
+
+    def readJoined(self):
+        ''' Yield (length, sequence) for the kept reads of each block, joined by N.
+
+        The N between reads keeps any kmer from spanning two of them, and
+        length counts only the bases of the reads. One sequence per block
+        packs and encodes in a few NumPy calls, where a read at a time
+        spends more on each call than on its bases.
+        '''
+        for headers, sequences, qualities in self.readBatches():
+            if sequences:
+                yield sum(map(len, sequences)), 'N'.join(sequences)
+
+########################################################################
+# PackedSequence
+########################################################################
+import numpy as np
+
+class PackedSequence:
+    ''' Hold a sequence as 2-bit base codes, four bases to a byte.
+
+    A, C, G and T pack as 0 to 3, the first base in the high bits of its
+    byte. Every other character is also kept in a side table of runs, so
+    the sequence comes back as it was, N runs and IUPAC codes included. A
+    genome takes a quarter of the bytes it does as a str.
+
+    attributes:
+    - length: the number of bases.
+    - packed: uint8 array of the packed base codes.
+    - runStarts, runEnds, runChars: the runs of characters other than
+      ACGT, from start up to end, and the character of each.
+
+    The following functions are included in PackedSequence class:
+    - from_fasta: yield (header, PackedSequence) for each FastA record.
+    - encoded: the base codes, 4 for anything but ACGT.
+    - code: the integer code of the kmer at a position.
+    - kmerCodes: the code of every kmer and whether it is all ACGT.
+    - reverseComplement: the reverse complement as a PackedSequence.
+    - toBytes: the sequence, or a slice of it, as bytes.
+    '''
+    baseCodes = np.full(256, 4, dtype=np.uint8)
+    for code, nuc in enumerate('ACGT'):
+        baseCodes[ord(nuc)] = code
+        baseCodes[ord(nuc.lower())] = code
+    letters = np.frombuffer(b'ACGT', dtype=np.uint8)
+    complements = bytes.maketrans(b'ACGTRYKMBVDHacgtrykmbvdh', b'TGCAYRMKVBHDtgcayrmkvbhd')
+    shifts = np.array([6, 4, 2, 0], dtype=np.uint8)
+
+    def __init__(self, sequence=''):
+        ''' Pack a sequence given as str or bytes. '''
+        if isinstance(sequence, str):
+            sequence = sequence.encode('ascii', 'replace')
+        raw = np.frombuffer(sequence, dtype=np.uint8)
+        codes = self.baseCodes[raw]
+        self.length = len(raw)
+        # lowercase acgt pack as their bases, and are runs so they come back
+        other = np.flatnonzero((codes > 3) | (raw > ord('Z')))
+        chars = raw[other]
+        newRun = np.ones(len(other), dtype=bool)
+        newRun[1:] = (other[1:] != other[:-1] + 1) | (chars[1:] != chars[:-1])
+        first = np.flatnonzero(newRun)
+        self.runStarts = other[first]
+        self.runEnds = np.append(other[first[1:] - 1], other[-1:]) + 1
+        self.runChars = chars[first]
+        self.packed = self.pack(np.where(codes > 3, 0, codes))
+
+    @classmethod
+    def from_fasta(cls, fname=''):
+        ''' Yield (header, PackedSequence) for each record of a FastA file, stdin by default. '''
+        for head, seq in FastAreader(fname).readFasta():
+            yield head, cls(seq)
+
+    @staticmethod
+    def pack(codes):
+        ''' Pack an array of base codes 0 to 3 four to a byte. '''
+        padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+        padded[:len(codes)] = codes
+        quads = padded.reshape(-1, 4)
+        return (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return self.toBytes().decode()
+
+    def __getitem__(self, index):
+        ''' Return a base, or a slice of the sequence, as str. '''
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return str(self)[index]
+            return self.toBytes(start, stop).decode()
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('PackedSequence index out of range')
+        return self.toBytes(index, index + 1).decode()
+
+    def unpack(self, start=0, end=None):
+        ''' Return the packed base codes from start up to end. '''
+        end = self.length if end is None else end
+        if end <= start:
+            return np.zeros(0, dtype=np.uint8)
+        quads = self.packed[start // 4:(end + 3) // 4]
+        codes = ((quads[:, None] >> self.shifts) & 3).ravel()
+        return codes[start % 4:start % 4 + end - start]
+
+    def runPositions(self, start=0, end=None):
+        ''' Return the positions from start up to end held in runs, and their characters. '''
+        end = self.length if end is None else end
+        first = np.searchsorted(self.runEnds, start, side='right')
+        last = np.searchsorted(self.runStarts, end, side='left')
+        starts = np.maximum(self.runStarts[first:last], start)
+        ends = np.minimum(self.runEnds[first:last], end)
+        lengths = ends - starts
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+        return positions, np.repeat(self.runChars[first:last], lengths)
+
+    def toBytes(self, start=0, end=None):
+        ''' Return the sequence from start up to end as bytes. '''
+        end = self.length if end is None else min(end, self.length)
+        if end <= start:
+            return b''
+        text = self.letters[self.unpack(start, end)]
+        positions, chars = self.runPositions(start, end)
+        text[positions - start] = chars
+        return text.tobytes()
+
+    def encoded(self):
+        ''' Return the base codes of the sequence, 4 for anything but ACGT. '''
+        codes = self.unpack()
+        positions, chars = self.runPositions()
+        codes[positions] = self.baseCodes[chars]
+        return codes
+
+    def code(self, i, k):
+        ''' Return the code of the kmer at position i, None if it is not all ACGT.
+
+        Only the bytes holding the kmer are read, whatever the sequence length.
+        '''
+        if i < 0 or i + k > self.length:
+            raise IndexError('kmer past the end of the PackedSequence')
+        run = np.searchsorted(self.runEnds, i, side='right')
+        while run < len(self.runStarts) and self.runStarts[run] < i + k:
+            if self.baseCodes[self.runChars[run]] > 3:
+                return None
+            run += 1
+        last = i + k - 1
+        value = int.from_bytes(self.packed[i // 4:last // 4 + 1].tobytes(), 'big')
+        return (value >> (2 * (3 - last % 4))) & ((1 << (2 * k)) - 1)
+
+    def kmerCodes(self, k):
+        ''' Return the code of every kmer, first base most significant, and whether it is all ACGT. '''
+        encoded = self.encoded()
+        n = len(encoded) - k + 1
+        if n <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+        codes = np.zeros(n, dtype=np.int64)
+        for j in range(k):
+            codes <<= 2
+            codes |= encoded[j:j + n] & 3
+        bad = np.concatenate(([0], np.cumsum(encoded > 3)))
+        return codes, bad[k:] == bad[:n]
+
+    def reverseComplement(self):
+        ''' Return the reverse complement as a new PackedSequence. '''
+        reverse = PackedSequence()
+        reverse.length = self.length
+        reverse.packed = self.pack(3 - self.unpack()[::-1])
+        reverse.runStarts = (self.length - self.runEnds)[::-1]
+        reverse.runEnds = (self.length - self.runStarts)[::-1]
+        chars = self.runChars[::-1].tobytes().translate(self.complements)
+        reverse.runChars = np.frombuffer(chars, dtype=np.uint8).copy()
+        return reverse
+
+########################################################################
+# KmerCounter
+########################################################################
+import numpy as np
+
+class KmerTable:
+    """ The counts and first-seen positions of the kmers of one size.
+
+        A dense table holds arrays of size 4^k indexed by kmer code. A
+        sparse table holds only the kmers it knows of, as a sorted array of
+        codes with the counts and first-seen positions alongside, and finds
+        a code by binary search.
+
+        attributes:
+        - k: the kmer size.
+        - codes: the sorted kmer codes of a sparse table, None when dense.
+        - counts: the count of each kmer.
+        - firstSeen: the first position each kmer was seen at.
+
+        The following functions are included in KmerTable class:
+        - lookup: counts and first-seen positions of given codes.
+        - observed: the codes with a count.
+    """
+    def __init__(self, k, counts, firstSeen, codes=None):
+        """ Hold the arrays of a dense table, or a sparse one given codes. """
+        self.k = k
+        self.codes = codes
+        self.counts = counts
+        self.firstSeen = firstSeen
+
+    def lookup(self, codes):
+        """ Return the counts and first-seen positions of an array of codes. """
+        if self.codes is None:
+            return self.counts[codes], self.firstSeen[codes]
+        if len(self.codes) == 0:
+            return (np.zeros(len(codes), dtype=np.int64),
+                    np.full(len(codes), KmerCounter.UNSEEN, dtype=np.int64))
+        codes = np.asarray(codes, dtype=np.int64)
+        if np.all(codes[1:] >= codes[:-1]):
+            index = np.searchsorted(self.codes, codes)
+        else:
+            # binary search is far faster on sorted queries
+            order = np.argsort(codes)
+            index = np.empty(len(codes), dtype=np.int64)
+            index[order] = np.searchsorted(self.codes, codes[order])
+        index = np.minimum(index, len(self.codes) - 1)
+        found = self.codes[index] == codes
+        return (np.where(found, self.counts[index], 0),
+                np.where(found, self.firstSeen[index], KmerCounter.UNSEEN))
+
+    def observed(self):
+        """ Return the sorted codes that have a count. """
+        if self.codes is None:
+            return np.flatnonzero(self.counts)
+        return self.codes[self.counts > 0]
+
+class KmerCounter:
+    """ Count k-mers as 2-bit integer codes held in NumPy arrays.
+
+        A sequence is encoded once into an array of base codes
+        (A=0, C=1, G=2, T=3, anything else=4). The k-mer starting at
+        position i then has the 64-bit integer code whose base-4 digits are
+        the bases i..i+k-1, first base most significant, so code order is
+        the lexicographic order of the k-mer strings. Up to DENSE_MAX the
+        counts live in dense arrays of size 4^k indexed by that code; past
+        it, up to k=31, in sparse tables built by sorting the codes.
+
+        The following functions are included in KmerCounter class:
+        - encode: 2-bit encode a sequence into base codes.
+        - kmerCodes: rolling k-mer codes and their validity mask.
+        - count: dense count table and first-seen positions for one k.
+        - countSparse: sorted codes, counts and first-seen positions for one k.
+        - reduceSorted: sum the counts of equal codes in a sorted array.
+        - mergeSparse: merge several sparse counts into one.
+        - countParallel: count over overlapping chunks in a process pool.
+        - countChunk: count the kmers starting in one chunk.
+        - countTable: KmerTable for one k.
+        - countRange: KmerTables for a range of k from a single pass.
+        - addTables: add the counts of one KmerTable to another.
+        - tails: the last k-1 bases of every run of ACGT bases.
+        - reverseComplement: reverse complement of an array of codes.
+        - reverseCodes: reverse complement of every code of length k.
+        - canonicalCodes: the codes of length k no larger than their reverse.
+        - canonical: combine the counts of each k-mer with its reverse.
+        - decode: the k-mer strings of an array of codes.
+    """
+    INVALID = 4
+    UNSEEN = np.iinfo(np.int64).max # first-seen position of a kmer never seen
+    DENSE_MAX = 12
+    SPARSE_MAX = 31
+    codeTable = np.full(256, INVALID, dtype=np.uint8)
+    for code, nuc in enumerate("ACGT"):
+        codeTable[ord(nuc)] = code
+        codeTable[ord(nuc.lower())] = code
+    # the reverse complement of the four bases packed in each byte value
+    reverseByte = np.zeros(256, dtype=np.uint8)
+    for byte in range(256):
+        for j in range(4):
+            reverseByte[byte] |= (3 - ((byte >> (2 * j)) & 3)) << (2 * (3 - j))
+
+    @staticmethod
+    def encode(sequence):
+        """ Encode a sequence string, or its bytes, into an array of base codes. """
+        if isinstance(sequence, str):
+            sequence = sequence.encode('ascii', 'replace')
+        raw = np.frombuffer(sequence, dtype=np.uint8)
+        return KmerCounter.codeTable[raw]
+
+    @staticmethod
+    def kmerCodes(encoded, k):
+        """ Return the code of every k-mer start and whether it is all ACGT. """
+        n = len(encoded) - k + 1
+        if n <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+        codes = np.zeros(n, dtype=np.int64)
+        for j in range(k):
+            # shift the window one base and bring in the next base code
+            codes <<= 2
+            codes |= encoded[j:j + n] & 3
+        bad = np.concatenate(([0], np.cumsum(encoded > 3)))
+        valid = bad[k:] == bad[:n]
+        return codes, valid
+
+    @staticmethod
+    def count(encoded, k):
+        """ Count the k-mers of an encoded sequence.
+
+            Returns the count array of size 4^k and, for every code, the
+            first position it was seen at (UNSEEN when never seen).
+        """
+        codes, valid = KmerCounter.kmerCodes(encoded, k)
+        positions = np.flatnonzero(valid)
+        codes = codes[valid]
+        counts = np.bincount(codes, minlength=4**k).astype(np.int64)
+        firstSeen = np.full(4**k, KmerCounter.UNSEEN, dtype=np.int64)
+        seen, index = np.unique(codes, return_index=True)
+        firstSeen[seen] = positions[index]
+        return counts, firstSeen
+
+    @staticmethod
+    def countSparse(encoded, k):
+        """ Count the k-mers of an encoded sequence by sorting their codes.
+
+            Returns the sorted codes seen, their counts and first positions.
+        """
+        codes, valid = KmerCounter.kmerCodes(encoded, k)
+        positions = np.flatnonzero(valid)
+        order = np.argsort(codes[valid], kind='stable') # equal codes stay in position order
+        return KmerCounter.reduceSorted(codes[valid][order], np.ones(len(order), dtype=np.int64),
+                                        positions[order])
+
+    @staticmethod
+    def reduceSorted(codes, counts, firstSeen):
+        """ Sum the counts, and take the first position, of equal codes.
+
+            codes must be sorted, the result holds each code once.
+        """
+        if len(codes) == 0:
+            return codes, counts, firstSeen
+        starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+        return (codes[starts], np.add.reduceat(counts, starts),
+                np.minimum.reduceat(firstSeen, starts))
+
+    @staticmethod
+    def mergeSparse(parts):
+        """ Merge a list of sparse (codes, counts, firstSeen) into one. """
+        codes, counts, firstSeen = (np.concatenate(arrays) for arrays in zip(*parts))
+        order = np.argsort(codes, kind='stable')
+        return KmerCounter.reduceSorted(codes[order], counts[order], firstSeen[order])
+
+    @staticmethod
+    def countChunk(chunk):
+        """ Count the k-mers starting in one chunk of a memory-mapped genome.
+
+            chunk is (path, length, k, start, end, sparse), the chunk reads
+            up to k-1 bases past end so no kmer is lost at the cut.
+        """
+        path, length, k, start, end, sparse = chunk
+        encoded = np.memmap(path, dtype=np.uint8, mode='r', shape=(length,))
+        piece = encoded[start:min(end + k - 1, length)]
+        if sparse:
+            codes, counts, firstSeen = KmerCounter.countSparse(piece, k)
+            return codes, counts, firstSeen + start
+        counts, firstSeen = KmerCounter.count(piece, k)
+        firstSeen = np.where(firstSeen < KmerCounter.UNSEEN, firstSeen + start, KmerCounter.UNSEEN)
+        return counts, firstSeen
+
+    @staticmethod
+    def countParallel(encoded, k, workers, sparse=False):
+        """ Count the k-mers of an encoded sequence with a process pool.
+
+            The genome is written once to a memory-mapped file that every
+            worker maps, so only chunk bounds are sent to the workers. The
+            partial tables are summed, giving the same result as count, or
+            as countSparse when sparse.
+        """
+        import multiprocessing
+        import tempfile
+        length = len(encoded)
+        bounds = np.linspace(0, length, workers + 1).astype(np.int64)
+        with tempfile.NamedTemporaryFile(prefix='missingMotif', suffix='.u8') as buffer:
+            encoded.tofile(buffer)
+            buffer.flush()
+            chunks = [(buffer.name, length, k, int(start), int(end), sparse)
+                      for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
+            with multiprocessing.Pool(workers) as pool:
+                if sparse:
+                    return KmerCounter.mergeSparse(pool.map(KmerCounter.countChunk, chunks))
+                counts = np.zeros(4**k, dtype=np.int64)
+                firstSeen = np.full(4**k, KmerCounter.UNSEEN, dtype=np.int64)
+                for chunkCounts, chunkFirst in pool.imap_unordered(KmerCounter.countChunk, chunks):
+                    counts += chunkCounts
+                    np.minimum(firstSeen, chunkFirst, out=firstSeen)
+        return counts, firstSeen
+
+    @staticmethod
+    def countTable(encoded, k, workers=1, sparse=False):
+        """ Count the k-mers of an encoded sequence into a KmerTable. """
+        if workers > 1:
+            counted = KmerCounter.countParallel(encoded, k, workers, sparse)
+        elif sparse:
+            counted = KmerCounter.countSparse(encoded, k)
+        else:
+            counted = KmerCounter.count(encoded, k)
+        if sparse:
+            codes, counts, firstSeen = counted
+            return KmerTable(k, counts, firstSeen, codes)
+        return KmerTable(k, *counted)
+
+    @staticmethod
+    def tails(encoded, k):
+        """ Cut out the last k-1 bases of every run of ACGT bases.
+
+            These are the positions where a shorter kmer starts but no
+            k-mer does. Returns the tails joined by separators and, for each
+            base of that array, its position in encoded.
+        """
+        valid = encoded <= 3
+        edges = np.diff(np.concatenate(([False], valid, [False])).astype(np.int8))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        tailStarts = np.maximum(starts, ends - (k - 1))
+        lengths = ends - tailStarts + 1  # one more slot for a separator
+        runOf = np.repeat(np.arange(len(ends)), lengths)
+        within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = tailStarts[runOf] + within
+        tail = encoded[np.minimum(positions, len(encoded) - 1)]
+        tail[within == lengths[runOf] - 1] = KmerCounter.INVALID
+        return tail, positions
+
+    @staticmethod
+    def countRange(encoded, minK, maxK, workers=1, sparse=False):
+        """ Count every k from minK to maxK with one pass at maxK.
+
+            The shorter tables are the maxK table summed over its trailing
+            bases, plus the kmers that start too close to the end of a
+            sequence (or a run of N) to begin a maxK-mer.
+            Returns a dict of k to KmerTable.
+        """
+        tables = dict()
+        if minK > maxK:
+            return tables
+        table = KmerCounter.countTable(encoded, maxK, workers, sparse)
+        tables[maxK] = table
+        tail, positions = KmerCounter.tails(encoded, maxK)
+        for k in range(minK, maxK):
+            if sparse:
+                tailCodes, tailCounts, tailFirst = KmerCounter.countSparse(tail, k)
+                # the maxK codes are sorted, so are their k-mer prefixes
+                prefixes = KmerCounter.reduceSorted(table.codes >> (2 * (maxK - k)),
+                                                    table.counts, table.firstSeen)
+                codes, counts, firstSeen = KmerCounter.mergeSparse(
+                    [prefixes, (tailCodes, tailCounts, positions[tailFirst])])
+                tables[k] = KmerTable(k, counts, firstSeen, codes)
+                continue
+            tailCounts, tailFirst = KmerCounter.count(tail, k)
+            seen = tailFirst < KmerCounter.UNSEEN
+            tailFirst[seen] = positions[tailFirst[seen]]
+            tables[k] = KmerTable(k, table.counts.reshape(4**k, -1).sum(axis=1) + tailCounts,
+                                  np.minimum(table.firstSeen.reshape(4**k, -1).min(axis=1), tailFirst))
+        return tables
+
+    @staticmethod
+    def addTables(table, added):
+        """ Add the counts of one KmerTable to another, keeping first seens.
+
+            A dense table is updated in place when its arrays are writable.
+        """
+        if table.codes is None and added.codes is None:
+            if table.counts.flags.writeable and table.firstSeen.flags.writeable:
+                table.counts += added.counts
+                np.minimum(table.firstSeen, added.firstSeen, out=table.firstSeen)
+                return table
+            return KmerTable(table.k, table.counts + added.counts,
+                             np.minimum(table.firstSeen, added.firstSeen))
+        parts = []
+        for part in (table, added):
+            if part.codes is None:
+                codes = part.observed()
+                parts.append((codes, part.counts[codes], part.firstSeen[codes]))
+            else:
+                parts.append((part.codes, part.counts, part.firstSeen))
+        codes, counts, firstSeen = KmerCounter.mergeSparse(parts)
+        return KmerTable(table.k, counts, firstSeen, codes)
+
+    @staticmethod
+    def reverseComplement(codes, k):
+        """ Return the reverse complement code of each code of length k. """
+        # complement every base (3 - code is code ^ 3), reverse the four
+        # bases within each byte by table and then the order of the bytes
+        codes = np.ascontiguousarray(codes, dtype='<i8')
+        reverse = KmerCounter.reverseByte[codes.view(np.uint8)].view('<u8').byteswap()
+        return (reverse >> np.uint64(64 - 2 * k)).astype(np.int64)
+
+    @staticmethod
+    def reverseCodes(k):
+        """ Return the reverse complement code of every code of length k. """
+        return KmerCounter.reverseComplement(np.arange(4**k, dtype=np.int64), k)
+
+    @staticmethod
+    def canonicalCodes(k):
+        """ Return the codes of size k that are no larger than their reverse. """
+        return np.flatnonzero(np.arange(4**k) <= KmerCounter.reverseCodes(k))
+
+    @staticmethod
+    def canonical(table):
+        """ Give each code the combined count of itself and its reverse.
+
+            A sparse result also holds the reverse of every code seen.
+        """
+        k = table.k
+        if table.codes is None:
+            reverse = KmerCounter.reverseCodes(k)
+            combined = table.counts + table.counts[reverse]
+            palindrome = reverse == np.arange(4**k)
+            combined[palindrome] = table.counts[palindrome]
+            return KmerTable(k, combined, table.firstSeen)
+        codes = np.sort(np.concatenate((table.codes, KmerCounter.reverseComplement(table.codes, k))))
+        distinct = np.ones(len(codes), dtype=bool)
+        distinct[1:] = codes[1:] != codes[:-1]
+        codes = codes[distinct]
+        reverse = KmerCounter.reverseComplement(codes, k)
+        counts, firstSeen = table.lookup(codes)
+        reverseCounts = table.lookup(reverse)[0]
+        combined = counts + np.where(reverse == codes, 0, reverseCounts)
+        return KmerTable(k, combined, firstSeen, codes)
+
+    @staticmethod
+    def decode(codes, k):
+        """ Return the k-mer strings of an array of codes. """
+        shifts = 2 * np.arange(k - 1, -1, -1, dtype=np.int64)
+        digits = (np.asarray(codes, dtype=np.int64)[:, None] >> shifts) & 3
+        letters = np.frombuffer(b"ACGT", dtype=np.uint8)[digits]
+        return letters.view('S{}'.format(k)).ravel().astype(str).tolist()
+
+########################################################################
+# CountCache
+########################################################################
+import os
+import hashlib
+
+class CountCache:
+    """ Keep the count tables of earlier runs on disk.
+
+        Each entry is one .npy file holding N and, for every k, the combined
+        counts and first-seen arrays (and codes, for sparse tables) back to
+        back after a small header. Entries are named by a hash of the
+        sequences and the k range, and are memory mapped when read so the
+        arrays are used without a copy. An entry covering a wider k range
+        also serves a narrower one. The least recently used entries are
+        removed once the cache grows past its size cap. Other processes
+        may share the directory, so an entry can go at any time, and a
+        cache that cannot be written is passed over with a warning: the
+        counts of a run are in memory either way.
+
+        attributes:
+        - directory: where the entries are kept.
+        - sizeCap: the most bytes the entries may take.
+
+        The following functions are included in CountCache class:
+        - create: a CountCache, or None when its directory cannot be made.
+        - warn: report a cache that cannot be written.
+        - key: the hash of a set of sequences.
+        - load: the tables of an entry covering a k range, or None.
+        - save: write the tables of a run as an entry.
+        - evict: remove old entries until under the size cap.
+    """
+    VERSION = 2
+
+    def __init__(self, directory=None, sizeCap=1024 * 2**20):
+        """ Set up the cache directory. """
+        if directory is None:
+            base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+            directory = os.path.join(base, 'missingMotif')
+        self.directory = directory
+        self.sizeCap = sizeCap
+        os.makedirs(self.directory, exist_ok=True)
+
+    @classmethod
+    def create(cls, directory=None, sizeCap=1024 * 2**20):
+        """ Return a CountCache, or None with a warning when its directory cannot be made. """
+        try:
+            return cls(directory, sizeCap)
+        except OSError as error:
+            cls.warn(error)
+            return None
+
+    @staticmethod
+    def warn(error):
+        """ Report on stderr that the run goes on without the cache. """
+        print("missingMotif: count cache not used: {}".format(error), file=sys.stderr)
+
+    @staticmethod
+    def key(sequences):
+        """ Hash the sequence content, record boundaries included.
+
+            A PackedSequence hashes as its str would, a block at a time.
+        """
+        digest = hashlib.sha1()
+        for seq in sequences:
+            if isinstance(seq, PackedSequence):
+                for start in range(0, len(seq), 2**20):
+                    digest.update(seq.toBytes(start, start + 2**20))
+            else:
+                digest.update(seq.encode('ascii', 'replace'))
+            digest.update(b'>')
+        return digest.hexdigest()
+
+    @staticmethod
+    def readEntry(entry, entryMin, entryMax):
+        """ Split an entry into N and its tables, or None if malformed. """
+        if len(entry) < 2 or entry[0] != CountCache.VERSION:
+            return None
+        sizes = range(entryMin, entryMax + 1)
+        offset = 2 + 2 * len(sizes) # version, N, then a size and a sparse flag per k
+        tables = dict()
+        for i, k in enumerate(sizes):
+            n, sparse = int(entry[2 + 2 * i]), int(entry[3 + 2 * i])
+            codes = None
+            if sparse:
+                codes = entry[offset:offset + n]
+                offset += n
+            tables[k] = KmerTable(k, entry[offset:offset + n], entry[offset + n:offset + 2 * n], codes)
+            offset += 2 * n
+        if offset != len(entry):
+            return None
+        return int(entry[1]), tables
+
+    def load(self, key, minK, maxK):
+        """ Find an entry covering minK to maxK, return (N, tables) or None. """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return None
+        for name in names:
+            parts = name[:-len('.npy')].split('-')
+            if not name.endswith('.npy') or len(parts) != 3 or parts[0] != key:
+                continue
+            entryMin, entryMax = int(parts[1]), int(parts[2])
+            if entryMin > minK or entryMax < maxK:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entry = self.readEntry(np.load(path, mmap_mode='r'), entryMin, entryMax)
+            except (OSError, ValueError):
+                continue
+            if entry is None:
+                continue
+            try:
+                os.utime(path) # mark as recently used
+            except FileNotFoundError:
+                continue # evicted by another process
+            N, tables = entry
+            return N, {k: tables[k] for k in range(minK, maxK + 1)}
+        return None
+
+    def save(self, key, minK, maxK, N, tables):
+        """ Write the KmerTables for minK to maxK as an entry. """
+        header = [self.VERSION, N]
+        sections = []
+        for k in range(minK, maxK + 1):
+            table = tables[k]
+            header += [len(table.counts), table.codes is not None]
+            if table.codes is not None:
+                sections.append(table.codes)
+            sections += [table.counts, table.firstSeen]
+        entry = np.concatenate([np.array(header, dtype=np.int64)] +
+                               [np.asarray(section, dtype=np.int64) for section in sections])
+        path = os.path.join(self.directory, '{}-{}-{}.npy'.format(key, minK, maxK))
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(temporary, 'wb') as fileH:
+                np.save(fileH, entry)
+            os.replace(temporary, path) # readers never see a partial entry
+            self.evict()
+        except OSError as error:
+            self.warn(error)
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+
+    def evict(self):
+        """ Remove the least recently used entries until under the size cap. """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue # evicted by another process
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.sizeCap:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass # evicted by another process first
+            total -= size
 
 ########################################################################
 # Genome
@@ -124,9 +1530,25 @@ class FastAreader:
 class Genome:
     """ Find the Z-score, Expected Value, and count of all motifs. 
 
+        attributes:
+        - sequences: the sequences of the genome, as str or PackedSequence.
+        - N: the total length of the sequences.
+        - minVal, maxVal: the motif size range.
+        - cutoff: the Z-score cutoff.
+        - tables: dict of k to a KmerTable of the count of each kmer and its
+          reverse compliment combined, and of the position it was first seen at.
+        - expected: dict of k to the kmer codes listed by the last kmerList
+          and their eValues, reused while their counts do not change.
+        - changed: dict of k to the codes whose counts changed since then.
+
         The following functions are included in Genome class:
         - Zscore: calculates Z score of given kmer.
         - eValue: calculate eValue of given kmer.
+        - count: the combined count of given kmer.
+        - encodeSequences: encode sequences into one array.
+        - add_sequences: count more sequences into the tables.
+        - expectTable: eValue of an array of kmer codes.
+        - scoreTable: count, eValue and Z score of an array of kmer codes.
         - kmerList: returns the kmer data.
     """
     @staticmethod
@@ -134,26 +1556,81 @@ class Genome:
         """ Find the reverse compliment. """
         return sequence.translate(str.maketrans("ATCG", "TAGC"))[::-1]
     
-    def __init__(self, sequences, N, minVal, maxVal, Zcutoff):
-        """Find the counts of all possible kmers in the sequence."""
+    def __init__(self, sequences, N, minVal, maxVal, Zcutoff, workers=1, cache=None, sparse=None):
+        """Find the counts of all possible kmers in the sequence.
+
+           When a CountCache is given, the tables are read from it if an
+           earlier run counted the same sequences, and saved to it if not.
+           Sparse tables are used past KmerCounter.DENSE_MAX, or as asked.
+        """
         self.sequences = sequences
         self.cutoff = Zcutoff
-        self.kmerCounts = dict()
         self.minVal = minVal
         self.maxVal = maxVal
         self.N = N
+        self.tables = dict()
+        self.expected = dict()
+        self.changed = dict()
+        if sparse is None:
+            sparse = self.maxVal > KmerCounter.DENSE_MAX
+        self.workers = workers
+        self.sparse = sparse
+
+        minK = max(1, self.minVal - 2)
+        if cache is not None:
+            key = cache.key(self.sequences)
+            cached = cache.load(key, minK, self.maxVal)
+            if cached is not None and cached[0] == self.N:
+                self.tables = cached[1]
+                return
+
+        # encode the genome once
+        encoded = self.encodeSequences(self.sequences)
+
+        tables = KmerCounter.countRange(encoded, minK, self.maxVal, workers, sparse)
+        for k, table in tables.items():
+            self.tables[k] = KmerCounter.canonical(table)
+        if cache is not None:
+            cache.save(key, minK, self.maxVal, self.N, self.tables)
+
+    @staticmethod
+    def encodeSequences(sequences):
+        """ Encode sequences into one array, a separator keeps kmers within a sequence. """
+        separator = np.full(1, KmerCounter.INVALID, dtype=np.uint8)
+        return np.concatenate([part for seq in sequences
+                               for part in (seq.encoded() if isinstance(seq, PackedSequence)
+                                            else KmerCounter.encode(seq), separator)]
+                              or [separator])
 
-        for seq in self.sequences:
-            for k in range(self.minVal - 2, self.maxVal + 1):
-                for i in range(len(seq) - k + 1):
-                    kmer = ''.join(seq[i:i+k])
-                    if self.reverseSeq(kmer) in self.kmerCounts:
-                        self.kmerCounts[kmer] = self.kmerCounts[self.reverseSeq(kmer)]
-                        self.kmerCounts[kmer][0]+=1
-                    elif kmer in self.kmerCounts:
-                        self.kmerCounts[kmer][0]+=1
-                    else:
-                        self.kmerCounts[kmer] = [1]
+    def add_sequences(self, sequences):
+        """ Count more sequences, such as new contigs, into the tables.
+
+            Only the new sequences are counted, their tables are added to
+            the existing ones and N grows by their length. The codes whose
+            counts changed are remembered, so the next kmerList recomputes
+            only the eValues that depend on them.
+        """
+        sequences = list(sequences)
+        offset = self.N + len(self.sequences) # the new sequences follow the old ones
+        encoded = self.encodeSequences(sequences)
+        tables = KmerCounter.countRange(encoded, max(1, self.minVal - 2), self.maxVal,
+                                        self.workers, self.sparse)
+        for k, table in tables.items():
+            added = KmerCounter.canonical(table)
+            added.firstSeen = np.where(added.firstSeen < KmerCounter.UNSEEN,
+                                       added.firstSeen + offset, KmerCounter.UNSEEN)
+            self.tables[k] = KmerCounter.addTables(self.tables[k], added)
+            changed = added.observed()
+            if k in self.changed:
+                changed = np.union1d(self.changed[k], changed)
+            self.changed[k] = changed
+        self.sequences = list(self.sequences) + sequences
+        self.N += sum(len(seq) for seq in sequences)
+
+    def count(self, kmer):
+        """ Find the count of the given kmer and its reverse compliment. """
+        code = int(kmer.translate(str.maketrans("ACGT", "0123")), 4)
+        return int(self.tables[len(kmer)].lookup(np.array([code]))[0][0])
 
     def Zscore(self, kmer):
         """ Find the Z-score of the given kmer. """
@@ -162,35 +1639,470 @@ class Genome:
         p = mean/N #finds p from the mean.
         stdDev = (N*p*(1 - p))**0.5 #finds stdDeviation
 
-        Ztop = self.kmerCounts[kmer][0] - mean
+        Ztop = self.count(kmer) - mean
         
         return Ztop/stdDev
 
     def eValue(self, kmer):
         """ Find the expected number of the given kmer. """
         end = len(kmer)-1
-        expectedNum = self.kmerCounts[kmer[:-1]][0] * self.kmerCounts[kmer[1:]][0] 
+        expectedNum = self.count(kmer[:-1]) * self.count(kmer[1:]) 
         #reports counts of each k-1mer and multiplies them
-        expectedDen = self.kmerCounts[kmer[1:end]][0] # divides by the k-2mer that contains the middle sequnces.
+        expectedDen = self.count(kmer[1:end]) # divides by the k-2mer that contains the middle sequnces.
         return expectedNum/expectedDen
+
+    def expectTable(self, k, codes):
+        """ Find the eValue of an array of kmer codes of size k.
+
+            Same arithmetic as eValue, done on the whole array. The eValue of
+            kmers whose middle was never seen is nan.
+        """
+        prefix = self.tables[k - 1].lookup(codes >> 2)[0]
+        suffix = self.tables[k - 1].lookup(codes & (4**(k - 1) - 1))[0]
+        middle = self.tables[k - 2].lookup((codes >> 2) & (4**(k - 2) - 1))[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (prefix * suffix) / middle
+
+    def scoreTable(self, k, codes, mean=None):
+        """ Find the count, eValue and Z-score of an array of kmer codes of size k.
+
+            Same arithmetic as eValue and Zscore, done on the whole array.
+            The eValue and Z-score of kmers whose middle was never seen are nan.
+            Known eValues of the codes can be given as mean.
+        """
+        count = self.tables[k].lookup(codes)[0]
+        if mean is None:
+            mean = self.expectTable(k, codes)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = mean / self.N
+            stdDev = np.power(self.N * p * (1 - p), 0.5)
+            Z = (count - mean) / stdDev
+        return count, mean, Z
                 
+    def reuseExpected(self, k, codes):
+        """ Find the eValues of sorted codes of size k, reusing the last kmerList's.
+
+            A kmer's eValue is recomputed only if it is new or the count of
+            its k-1mers or k-2mer changed since. Returns None when nothing
+            is known yet.
+        """
+        if k not in self.expected:
+            return None
+        known, knownMean = self.expected[k]
+        if not self.changed and len(known) == len(codes) and np.array_equal(known, codes):
+            return knownMean
+        index = np.minimum(np.searchsorted(known, codes), max(len(known) - 1, 0))
+        stale = np.ones(len(codes), dtype=bool) if len(known) == 0 else known[index] != codes
+        for size, parts in ((k - 1, codes >> 2), (k - 1, codes & (4**(k - 1) - 1)),
+                            (k - 2, (codes >> 2) & (4**(k - 2) - 1))):
+            if size in self.changed:
+                stale |= np.isin(parts, self.changed[size])
+        mean = np.empty(len(codes))
+        mean[~stale] = knownMean[index[~stale]]
+        mean[stale] = self.expectTable(k, codes[stale])
+        return mean
+
     def kmerList(self):
         """ Return a list of the kmer data. """
-        kmax = 8
+        kmax = self.maxVal
+        rows = [] # per kmer size: codes, reverse codes, count, eValue, Z-score, first seen
+        for k in range(self.minVal, self.maxVal + 1):
+            table = self.tables[k]
+            codes = table.observed()
+            reverse = KmerCounter.reverseComplement(codes, k)
+            # keep each kmer once, as the one of the pair seen first
+            keep = (table.lookup(codes)[1] < table.lookup(reverse)[1]) | (reverse == codes)
+            codes, reverse = codes[keep], reverse[keep]
+            count, mean, Z = self.scoreTable(k, codes, self.reuseExpected(k, codes))
+            self.expected[k] = (codes, mean)
+            keep = Z < self.cutoff # and only when the Zscore is below the cutoff
+            codes = codes[keep]
+            rows.append((k, codes, reverse[keep], count[keep], mean[keep], Z[keep],
+                         table.lookup(codes)[1]))
+        self.changed = dict()
+        if not rows:
+            return []
+        sizes = np.concatenate([np.full(len(row[1]), row[0]) for row in rows])
+        Zs = np.concatenate([row[5] for row in rows])
+        order = np.lexsort((np.concatenate([row[6] for row in rows]), Zs, kmax - sizes))
+        # sort by size, largest first, then Zscore, then first seen
+
         kmerlist = list() # empty list, intended to be a list of lists.
-        listcheck = list() # list of what has been added.
-        for kmer in self.kmerCounts.keys():
-            if len(kmer) >= self.minVal and len(kmer) <= self.maxVal and \
-                self.reverseSeq(kmer) not in listcheck and self.Zscore(kmer) < self.cutoff:
-                #    ensures the following:
-                # 1. the kmer size between min and max
-                # 2. the reverse has not been added yet
-                # 3. the Zscore is below the cutoff
-                thek = kmax - len(kmer)
-                kmerlist.append([kmer, self.reverseSeq(kmer), self.kmerCounts[kmer][0], self.eValue(kmer), self.Zscore(kmer), thek])
-                listcheck.append(kmer)
-        
-        return sorted(kmerlist, key=lambda kmer:(kmer[5], kmer[4]))
+        for k, codes, reverses, counts, means, Zscores, _ in rows:
+            kmerlist.extend([kmer, reverse, kmerCount, mean, Z, kmax - k]
+                            for kmer, reverse, kmerCount, mean, Z in
+                            zip(KmerCounter.decode(codes, k), KmerCounter.decode(reverses, k),
+                                counts.tolist(), means.tolist(), Zscores.tolist()))
+        return [kmerlist[i] for i in order.tolist()]
+
+
+########################################################################
+# MotifWindows
+########################################################################
+
+class MotifWindows:
+    """ Find the count, Expected Value and Z-score of motifs in sliding windows.
+
+        Each window is scored the same way Genome scores the whole genome,
+        with the window length as N. For every motif, its k-1mers and its
+        k-2mer an occurrence array is prefix summed once per sequence, so
+        the count in any window is the difference of two entries.
+
+        attributes:
+        - motifs: the motifs to scan for.
+        - window: the window size.
+        - step: the distance between window starts.
+
+        The following functions are included in MotifWindows class:
+        - occurrences: prefix-summed occurrence arrays of the motif parts.
+        - scan: the per window data of one sequence.
+    """
+    sliceSize = 2**16 # windows scored at a time
+    def __init__(self, motifs, window, step):
+        """ Save the motifs and the window layout. """
+        self.motifs = [motif.upper() for motif in motifs]
+        self.window = window
+        self.step = step
+
+    def occurrences(self, encoded):
+        """ Prefix sum the occurrences of every motif, k-1mer and k-2mer.
+
+            Returns a dict of kmer to an array whose entry i is the count of
+            the kmer and its reverse compliment starting before position i.
+        """
+        parts = dict()
+        for motif in self.motifs:
+            for kmer in (motif, motif[:-1], motif[1:], motif[1:-1]):
+                parts.setdefault(len(kmer), set()).add(kmer)
+        sums = dict()
+        for k, kmers in parts.items():
+            codes, valid = KmerCounter.kmerCodes(encoded, k)
+            for kmer in kmers:
+                code = KmerCounter.kmerCodes(KmerCounter.encode(kmer), k)[0]
+                reverse = KmerCounter.reverseComplement(code, k)
+                found = ((codes == code[0]) | (codes == reverse[0])) & valid
+                sums[kmer] = np.concatenate(([0], np.cumsum(found, dtype=np.int64)))
+        return sums
+
+    def scan(self, name, sequence):
+        """ Yield (name, start, end, motif, count, Expect, Zscore) per window and motif. """
+        length = len(sequence)
+        sums = self.occurrences(KmerCounter.encode(sequence))
+        # the last window is cut short at the end of the sequence when needed
+        windowCount = len(range(0, max(length - self.window, 0) + self.step, self.step))
+
+        def kmerCount(kmer, starts, ends):
+            """ Count kmer and its reverse compliment starting in each window. """
+            last = len(sums[kmer]) - 1 # number of kmer starts in the sequence
+            return (sums[kmer][np.clip(ends - len(kmer) + 1, 0, last)] -
+                    sums[kmer][np.clip(starts, 0, last)])
+
+        # windows are scored a slice at a time, so rows go out as they are found
+        for first in range(0, windowCount, self.sliceSize):
+            starts = np.arange(first, min(first + self.sliceSize, windowCount), dtype=np.int64) * self.step
+            ends = np.minimum(starts + self.window, length)
+            columns = []
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for motif in self.motifs:
+                    count = kmerCount(motif, starts, ends)
+                    mean = (kmerCount(motif[:-1], starts, ends) * kmerCount(motif[1:], starts, ends) /
+                            kmerCount(motif[1:-1], starts, ends))
+                    p = mean / (ends - starts)
+                    Z = (count - mean) / np.power((ends - starts) * p * (1 - p), 0.5)
+                    columns.append((count.tolist(), mean.tolist(), Z.tolist()))
+            for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+                for motif, (count, mean, Z) in zip(self.motifs, columns):
+                    yield name, start, end, motif, count[i], mean[i], Z[i]
+
+
+########################################################################
+# GenomeComparison
+########################################################################
+
+class GenomeComparison:
+    """ Find the Z-score of every motif in many genomes at once.
+
+        Each genome is counted and scored by a Genome in its own worker
+        process, over the same canonical code space (each kmer and its
+        reverse compliment as the smaller of the two codes), so the scores
+        of all genomes are joined by stacking arrays.
+
+        attributes:
+        - paths: the FastA file of each genome.
+        - minVal, maxVal: the motif size range.
+        - cutoff: a motif is kept if below the Z-score cutoff in any genome.
+        - workers: the number of genomes scored at a time.
+        - cacheDir, cacheSize: the CountCache the workers share, no cache if
+          cacheSize is None.
+
+        The following functions are included in GenomeComparison class:
+        - scoreGenome: the Z-scores of one genome.
+        - scores: the Z-scores of every genome, in order.
+        - matrix: the motif by genome table.
+    """
+    def __init__(self, paths, minVal, maxVal, Zcutoff, workers=1, cacheDir=None, cacheSize=None):
+        """ Save the genomes and the motif options. """
+        self.paths = paths
+        self.minVal = minVal
+        self.maxVal = maxVal
+        self.cutoff = Zcutoff
+        self.workers = workers
+        self.cacheDir = cacheDir
+        self.cacheSize = cacheSize
+
+    @staticmethod
+    def scoreGenome(task):
+        """ Score one genome, task is (path, minVal, maxVal, cacheDir, cacheSize).
+
+            Returns a dict of k to the Z-scores of the canonical codes, nan
+            where the genome gives no expectation.
+        """
+        path, minVal, maxVal, cacheDir, cacheSize = task
+        sequences = [seq for head, seq in PackedSequence.from_fasta(path)]
+        cache = None if cacheSize is None else CountCache.create(cacheDir, cacheSize)
+        G = Genome(sequences, sum(len(seq) for seq in sequences), minVal, maxVal, 0.0, cache=cache)
+        return {k: G.scoreTable(k, KmerCounter.canonicalCodes(k))[2]
+                for k in range(minVal, maxVal + 1)}
+
+    def scores(self):
+        """ Score every genome in a process pool, return them in order.
+
+            At most two tasks per worker are queued at a time.
+        """
+        import collections
+        import multiprocessing
+        tasks = [(path, self.minVal, self.maxVal, self.cacheDir, self.cacheSize) for path in self.paths]
+        if self.workers <= 1:
+            return [self.scoreGenome(task) for task in tasks]
+        results = []
+        with multiprocessing.Pool(self.workers) as pool:
+            pending = collections.deque()
+            for task in tasks:
+                if len(pending) >= 2 * self.workers:
+                    results.append(pending.popleft().get())
+                pending.append(pool.apply_async(GenomeComparison.scoreGenome, (task,)))
+            results.extend(job.get() for job in pending)
+        return results
+
+    def matrix(self):
+        """ Return a list of [kmer, reverse, Z-score per genome] rows.
+
+            Sorted by size, largest first, then by the lowest Z-score across
+            the genomes, then by kmer.
+        """
+        genomes = self.scores()
+        rows = []
+        for k in range(self.maxVal, self.minVal - 1, -1):
+            codes = KmerCounter.canonicalCodes(k)
+            Z = np.stack([scores[k] for scores in genomes]) # genome by motif
+            with np.errstate(invalid='ignore'):
+                keep = (Z < self.cutoff).any(axis=0)
+            codes, Z = codes[keep], Z[:, keep]
+            lowest = np.where(np.isnan(Z), np.inf, Z).min(axis=0)
+            order = np.lexsort((codes, lowest))
+            codes, Z = codes[order], Z[:, order]
+            kmers = KmerCounter.decode(codes, k)
+            reverses = KmerCounter.decode(KmerCounter.reverseComplement(codes, k), k)
+            rows.extend([kmer, reverse, column]
+                        for kmer, reverse, column in zip(kmers, reverses, Z.T.tolist()))
+        return rows
+
+
+########################################################################
+# CountMinSketch
+########################################################################
+import math
+
+class CountMinSketch:
+    """ Approximate counts of integer keys in fixed memory.
+
+        depth rows of width counters, each row with its own multiply-shift
+        hash. Updates are conservative: a key only raises its counters up
+        to its new estimate. An estimate is never below the true count, and
+        with probability 1 - delta is at most epsilon * total above it.
+
+        attributes:
+        - width: counters per row, a power of two.
+        - depth: the number of rows.
+        - table: the depth by width counters, 64 bits each so none wrap.
+        - total: the sum of all counts added.
+
+        The following functions are included in CountMinSketch class:
+        - fromError: a sketch sized for an error bound and a confidence.
+        - cells: the counter of each key in each row.
+        - add: count an array of keys.
+        - estimate: the estimated count of an array of keys.
+        - error: the most an estimate may be over the true count.
+    """
+    def __init__(self, width, depth, seed=205):
+        """ Set up an empty sketch, width is rounded up to a power of two. """
+        self.bits = max(1, math.ceil(math.log2(width)))
+        self.width = 2**self.bits
+        self.depth = depth
+        self.table = np.zeros((depth, self.width), dtype=np.uint64)
+        self.total = 0
+        rng = np.random.default_rng(seed)
+        self.multipliers = rng.integers(0, 2**63, size=(depth, 1), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.offsets = rng.integers(0, 2**63, size=(depth, 1), dtype=np.uint64)
+
+    @staticmethod
+    def fromError(epsilon, delta):
+        """ Size a sketch so estimates are within epsilon * total with probability 1 - delta. """
+        return CountMinSketch(math.ceil(math.e / epsilon), max(1, math.ceil(math.log(1 / delta))))
+
+    def cells(self, keys):
+        """ Hash keys into a depth by len(keys) array of column indexes. """
+        keys = np.asarray(keys).astype(np.uint64)[None, :]
+        return ((keys * self.multipliers + self.offsets) >> np.uint64(64 - self.bits)).astype(np.int64)
+
+    def add(self, keys):
+        """ Count each key of an array once, by conservative update. """
+        if len(keys) == 0:
+            return
+        keys = np.sort(keys)
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        weights = np.diff(np.append(starts, len(keys)))
+        keys = keys[starts]
+        cells = self.cells(keys)
+        rows = np.broadcast_to(np.arange(self.depth)[:, None], cells.shape)
+        estimate = self.table[rows, cells].min(axis=0).astype(np.int64)
+        raised = np.broadcast_to((estimate + weights).astype(np.uint64), cells.shape)
+        np.maximum.at(self.table, (rows, cells), raised)
+        self.total += int(weights.sum())
+
+    def estimate(self, keys):
+        """ Return the estimated counts of an array of keys. """
+        cells = self.cells(keys)
+        rows = np.broadcast_to(np.arange(self.depth)[:, None], cells.shape)
+        return self.table[rows, cells].min(axis=0).astype(np.int64)
+
+    def error(self):
+        """ The most an estimate is over its count, with probability 1 - delta. """
+        return math.e / self.width * self.total
+
+########################################################################
+# SketchGenome
+########################################################################
+
+class SketchGenome:
+    """ Find approximate Z-scores of motifs from count-min sketches.
+
+        Sequences are streamed in blocks, and every kmer from minMotif-2 to
+        maxMotif is added to the sketch of its size under its canonical
+        code (the smaller of it and its reverse compliment), so memory does
+        not grow with the input. Counts, eValues and Z-scores come from the
+        sketch estimates, and the sketch error bound gives the lowest and
+        highest Z-score each motif could have.
+
+        attributes:
+        - N: the total length of the sequences.
+        - minVal, maxVal: the motif size range.
+        - cutoff: the Z-score cutoff.
+        - sketches: dict of k to the CountMinSketch of that size.
+        - motifs: the motifs to score past KmerCounter.DENSE_MAX, where
+          every kmer can no longer be listed.
+
+        The following functions are included in SketchGenome class:
+        - add: stream one sequence into the sketches.
+        - bounds: lowest, estimated and highest count of an array of codes.
+        - Zscore: Z-scores of arrays of counts and eValues.
+        - kmerList: returns the kmer data with Z-score error bars.
+    """
+    BLOCK = 2**20
+
+    def __init__(self, minVal, maxVal, Zcutoff, epsilon=1e-5, delta=0.01,
+                 width=None, depth=None, motifs=None):
+        """ Set up one empty sketch per kmer size. """
+        self.N = 0
+        self.minVal = minVal
+        self.maxVal = maxVal
+        self.cutoff = Zcutoff
+        self.motifs = [motif.upper() for motif in motifs or []]
+        self.sketches = dict()
+        for k in range(max(1, minVal - 2), maxVal + 1):
+            if width is None and depth is None:
+                self.sketches[k] = CountMinSketch.fromError(epsilon, delta)
+            else:
+                sized = CountMinSketch.fromError(epsilon, delta)
+                self.sketches[k] = CountMinSketch(width or sized.width, depth or sized.depth)
+
+    def add(self, sequence, length=None):
+        """ Add the kmers of one sequence to the sketches, a block at a time.
+
+            length is the number of bases counted in N when it is not the
+            length of sequence, as for reads joined by separators.
+        """
+        N = self.N
+        for start, window, last in FastAreader.windowPieces(
+                [sequence.encode('ascii', 'replace')], self.BLOCK + self.maxVal - 1, self.maxVal - 1):
+            self.addWindow(window, last)
+        if length is not None:
+            self.N = N + length
+
+    def addWindow(self, window, last):
+        """ Add the kmers that start in one window of a sequence to the sketches.
+
+            Windows are BLOCK + maxVal - 1 bases and start BLOCK apart, as
+            given by FastAreader.readWindows. A window adds the kmers that
+            start in its first BLOCK bases, the last window of a sequence
+            adds all of its kmers.
+        """
+        self.N += len(window) if last else self.BLOCK
+        encoded = KmerCounter.encode(window)
+        for k, sketch in self.sketches.items():
+            codes, valid = KmerCounter.kmerCodes(encoded if last else encoded[:self.BLOCK + k - 1], k)
+            codes = codes[valid]
+            sketch.add(np.minimum(codes, KmerCounter.reverseComplement(codes, k)))
+
+    def bounds(self, k, codes):
+        """ Return the lowest, estimated and highest count of kmer codes. """
+        canonical = np.minimum(codes, KmerCounter.reverseComplement(codes, k))
+        high = self.sketches[k].estimate(canonical)
+        return np.maximum(high - self.sketches[k].error(), 0), high, high
+
+    def Zscore(self, count, mean):
+        """ Find the Z-scores of arrays of counts and eValues, as Genome.Zscore. """
+        p = mean / self.N
+        return (count - mean) / np.power(self.N * p * (1 - p), 0.5)
+
+    def kmerList(self):
+        """ Return a list of the kmer data.
+
+            Each row is kmer, reverse, count, eValue, Z-score, lowest Z-score,
+            highest Z-score and the sort key, sorted like Genome.kmerList with
+            ties by kmer.
+        """
+        rows = []
+        for k in range(self.maxVal, self.minVal - 1, -1):
+            if k <= KmerCounter.DENSE_MAX:
+                codes = KmerCounter.canonicalCodes(k)
+            else:
+                motifs = [motif for motif in self.motifs if len(motif) == k]
+                codes = np.array([int(motif.translate(str.maketrans("ACGT", "0123")), 4)
+                                  for motif in motifs], dtype=np.int64)
+            countLow, count, countHigh = self.bounds(k, codes)
+            seen = count > 0
+            codes, countLow, count, countHigh = codes[seen], countLow[seen], count[seen], countHigh[seen]
+            prefix = self.bounds(k - 1, codes >> 2)
+            suffix = self.bounds(k - 1, codes & (4**(k - 1) - 1))
+            middle = self.bounds(k - 2, (codes >> 2) & (4**(k - 2) - 1))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # eValue from the estimates, and from the bounds the widest it could be
+                mean = prefix[1] * suffix[1] / middle[1]
+                meanLow = prefix[0] * suffix[0] / np.maximum(middle[2], 1)
+                meanHigh = prefix[2] * suffix[2] / np.maximum(middle[0], 1)
+                Z = self.Zscore(count, mean)
+                Zlow = self.Zscore(countLow, meanHigh)
+                Zhigh = self.Zscore(countHigh, meanLow)
+            keep = np.flatnonzero(Z < self.cutoff)
+            keep = keep[np.lexsort((codes[keep], Z[keep]))] # by Zscore, then kmer
+            kmers = KmerCounter.decode(codes[keep], k)
+            reverses = KmerCounter.decode(KmerCounter.reverseComplement(codes[keep], k), k)
+            values = zip(count[keep].tolist(), mean[keep].tolist(), Z[keep].tolist(),
+                         Zlow[keep].tolist(), Zhigh[keep].tolist())
+            rows.extend([kmer, reverse, *value, self.maxVal - k]
+                        for kmer, reverse, value in zip(kmers, reverses, values))
+        return rows
 
 
 ########################################################################
@@ -207,14 +2119,69 @@ def main(myCommandLine=None):
         command = CommandLine()  # read options from the command line
     else :
         command = CommandLine(myCommandLine) # interpret the list passed from the caller of main as the commandline.
-    if sys.stdin:
+    reads = None
+    if command.args.fastq:
+        reads = FastQreader('', command.args.trimQuality, command.args.minQuality, command.args.minLength)
+    if command.args.genomes is not None:
+        # one genome per worker, joined into one table
+        if command.args.maxMotif > KmerCounter.DENSE_MAX:
+            raise Usage("Usage: missingMotif.py --genomes needs --maxMotif {} or less".format(KmerCounter.DENSE_MAX))
+        cache = None
+        if command.args.cache:
+            cache = CountCache.create(command.args.cacheDir, int(command.args.cacheSize * 2**20))
+        comparison = GenomeComparison(command.args.genomes, command.args.minMotif, command.args.maxMotif,
+                                      command.args.cutoff, command.args.workers,
+                                      cache and cache.directory, cache and cache.sizeCap)
+        names = [os.path.basename(path) for path in command.args.genomes]
+        print("sequence:reverse\t" + "\t".join(names))
+        for kmer, reverse, Zscores in comparison.matrix():
+            print('{0:8}:{1:8}\t'.format(kmer, reverse) + '\t'.join('{0:0.2f}'.format(Z) for Z in Zscores))
+    elif command.args.window is not None:
+        # score each sequence window by window, writing as we go
+        motifs = (command.args.motifs or '').split(',')
+        if command.args.window < 1 or (command.args.step is not None and command.args.step < 1) \
+                or not all(len(motif) >= 3 and set(motif.upper()) <= set("ACGT") for motif in motifs):
+            raise Usage("Usage: missingMotif.py --window W [--step S] --motifs MOTIF,... <infile >outfile")
+        scanner = MotifWindows(motifs, command.args.window, command.args.step or command.args.window)
+        print("#chrom\tstart\tend\tmotif\tcount\tExpect\tZscore")
+        for head, seq in reads.readFastq() if reads else FastAreader().readFasta():
+            name = head.split()[0] if head.split() else head
+            for row in scanner.scan(name, seq):
+                print('{0}\t{1}\t{2}\t{3}\t{4:0d}\t{5:0.2f}\t{6:0.2f}'.format(*row))
+    elif command.args.sketch:
+        # stream the sequences through the sketches, never holding them all
+        S = SketchGenome(command.args.minMotif, command.args.maxMotif, command.args.cutoff,
+                         command.args.epsilon, command.args.delta, command.args.width, command.args.depth,
+                         command.args.motifs.split(',') if command.args.motifs else None)
+        if reads:
+            for length, seq in reads.readJoined():
+                S.add(seq, length)
+        else:
+            # windows keep memory use constant however long the sequences are
+            for head, start, window, last in FastAreader().readWindows(
+                    SketchGenome.BLOCK + command.args.maxMotif - 1, command.args.maxMotif - 1):
+                S.addWindow(window, last)
+        print("sequence:reverse\tcount\tExpect\tZscore\tZlow\tZhigh")
+        for kmer in S.kmerList():
+            print('{0:8}:{1:8}\t{2:0d}\t{3:0.2f}\t{4:0.2f}\t{5:0.2f}\t{6:0.2f}'.format(*kmer[:7]))
+    elif sys.stdin:
         sequences = [] #an array of all the sequences in the fasta file.
         N = 0 # the len of each sequence.
-        for head, seq in FastAreader().readFasta():
-            sequences.append(seq)
-            N+=len(seq)
+        if reads:
+            # the reads of a block are packed together, by read they would take more memory
+            for length, seq in reads.readJoined():
+                sequences.append(PackedSequence(seq))
+                N+=length
+        else:
+            for head, seq in FastAreader().readParallel(command.args.workers):
+                sequences.append(PackedSequence(seq)) # a quarter of the memory of the str
+                N+=len(seq)
         #set up for printing.
-        G = Genome(sequences, N, command.args.minMotif, command.args.maxMotif, command.args.cutoff) 
+        cache = None
+        if command.args.cache:
+            cache = CountCache.create(command.args.cacheDir, int(command.args.cacheSize * 2**20))
+        G = Genome(sequences, N, command.args.minMotif, command.args.maxMotif, command.args.cutoff,
+                   command.args.workers, cache, command.args.sparse or None)
         # feeds the commandline options to the Genome class
         kmerList = G.kmerList() #produces a list with the 
 
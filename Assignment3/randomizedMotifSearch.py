@@ -54,6 +54,30 @@ class CommandLine():
             default = 3, help = 'give an integer for motif length')
         self.parser.add_argument('-p','--psuedocounts', type = float, action = 'store', \
             default = 0, help = 'Give an integer for pseudocount')
+        self.parser.add_argument('-w','--workers', type = int, action = 'store', \
+            default = None, help = 'give an integer for restart processes')
+        self.parser.add_argument('-s','--seed', type = int, action = 'store', \
+            default = None, help = 'give an integer seed for repeatable restarts')
+        self.parser.add_argument('-g','--gibbs', type = int, action = 'store', \
+            default = None, help = 'give a number of Gibbs sampling steps per restart')
+        self.parser.add_argument('-t','--time-budget', dest = 'timeBudget', type = float, action = 'store', \
+            default = None, help = 'give seconds to keep restarting for, in place of -i')
+        self.parser.add_argument('--patience', type = int, action = 'store', \
+            default = None, help = 'give restarts without a better entropy to stop after, in place of -i')
+        self.parser.add_argument('-c','--checkpoint', action = 'store', \
+            default = None, help = 'give a file to write the best result so far to')
+        self.parser.add_argument('-e','--exact', action = 'store_true', \
+            help = 'find the median string exactly in place of restarts')
+        self.parser.add_argument('--exactLimit', type = float, action = 'store', \
+            default = 0, help = 'give the most patterns times kmers to search exactly in place of restarts')
+        self.parser.add_argument('--scan', action = 'store', \
+            default = None, help = 'give a FASTA genome to scan for hits of the profile on both strands')
+        self.parser.add_argument('--profile', action = 'store', \
+            default = None, help = 'give a saved profile to scan with in place of searching')
+        self.parser.add_argument('--saveProfile', action = 'store', \
+            default = None, help = 'give a file to save the best profile to')
+        self.parser.add_argument('--threshold', type = float, action = 'store', \
+            default = None, help = 'give the least log-odds score in bits of a hit, 80%% of the best by default')
         if inOpts is None :
             self.args = self.parser.parse_args()
         else :
@@ -71,6 +95,17 @@ class Usage(Exception):
 # FastAreader
 ########################################################################
 import sys
+import os
+import mmap
+import io
+import itertools
+import zlib
+import queue
+import threading
+import bisect
+import struct
+import collections
+from concurrent.futures import ThreadPoolExecutor
 class FastAreader:
     '''
     Define objects to read FastA files.
@@ -80,44 +115,785 @@ class FastAreader:
     usage:
     for head, seq in thisReader.readFasta():
         print (head,seq)
+    for head, start, window, last in thisReader.readWindows(2**20, 30):
+        print (head, start, bytes(window))
+    for head, seq in thisReader.readParallel(4):
+        print (head,seq)
+    random access, through a .fai index beside the file:
+    thisReader.fetch('chr1:1001-2000')
+    gzip and BGZF (bgzip) input is inflated as it is read, and a BGZF
+    file can be fetched from too, through a .gzi block table beside it.
     '''
 
     def __init__(self, fname=''):
         '''contructor: saves attribute fname '''
         self.fname = fname
+        self.faIndex = None
+        self.faMap = None
+        self.faBlocks = None
+
+    # one bytes.translate call per block uppercases and strips whitespace
+    blockSize = 2**20
+    upperTable = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz', b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+    whitespace = b' \t\n\r\v\f'
+    # compressed input is inflated by these many threads, with at most
+    # queueSize inflated blocks waiting to be parsed
+    threads = min(4, os.cpu_count() or 1)
+    queueSize = 8
+    # readParallel gives each worker byte ranges of at most rangeSize
+    rangeSize = 2**26
+    gzipMagic = b'\x1f\x8b'
 
     def doOpen(self):
         ''' Handle file opens, allowing STDIN.'''
-        if self.fname is '':
+        if self.fname == '':
             return sys.stdin
         else:
             return open(self.fname)
 
-    def readFasta(self):
-        ''' Read an entire FastA record and return the sequence header/sequence'''
-        header = ''
-        sequence = ''
+    def doOpenBytes(self):
+        ''' Handle binary file opens, allowing STDIN.'''
+        if self.fname == '':
+            return sys.stdin.buffer
+        else:
+            return open(self.fname, 'rb')
 
-        with self.doOpen() as fileH:
+    def readBlocks(self):
+        ''' Yield the raw bytes of the input, a block at a time.
 
-            header = ''
-            sequence = ''
+        gzip input, told by its magic bytes, is inflated as it is read, so
+        inflation overlaps the parsing of the blocks already given out. A
+        BGZF file is inflated by a pool of threads, other gzip by one
+        background thread.
+        '''
+        with self.doOpenBytes() as fileH:
+            head = self.readExactly(fileH, 18)
+            kind = self.kindOf(head)
+            if kind == 'bgzf':
+                yield from self.inflateBgzf(fileH, head)
+                return
+            if kind == 'gzip':
+                yield from self.inflateGzip(fileH, head)
+                return
+            block = head
+            while block:
+                yield block
+                block = fileH.read(self.blockSize)
 
-            # skip to first fasta header
-            line = fileH.readline()
-            while not line.startswith('>'):
-                line = fileH.readline()
-            header = line[1:].rstrip()
+    @staticmethod
+    def readExactly(fileH, size):
+        ''' Read size bytes, fewer only at the end of the file. '''
+        data = fileH.read(size)
+        while 0 < len(data) < size:
+            more = fileH.read(size - len(data))
+            if not more:
+                break
+            data += more
+        return data
 
-            for line in fileH:
-                if line.startswith('>'):
-                    yield header, sequence
-                    header = line[1:].rstrip()
-                    sequence = ''
+    @classmethod
+    def kindOf(cls, head):
+        ''' Return 'bgzf', 'gzip' or None from the first 18 bytes of a file. '''
+        if not head.startswith(cls.gzipMagic):
+            return None
+        return 'bgzf' if cls.bgzfSize(head) is not None else 'gzip'
+
+    @staticmethod
+    def bgzfSize(header):
+        ''' Return the size of the BGZF block with this 18 byte header, None if it is not one. '''
+        if len(header) < 18 or header[:4] != b'\x1f\x8b\x08\x04' or \
+           header[10:16] != b'\x06\x00BC\x02\x00':
+            return None
+        return int.from_bytes(header[16:18], 'little') + 1
+
+    @classmethod
+    def bgzfBlocks(cls, fileH, head=b''):
+        ''' Yield the compressed bytes of each BGZF block of a file. '''
+        header = head + cls.readExactly(fileH, 18 - len(head))
+        while header:
+            size = cls.bgzfSize(header)
+            if size is None:
+                raise ValueError('{} is not a BGZF block'.format(header[:18]))
+            block = header + cls.readExactly(fileH, size - 18)
+            if len(block) < size:
+                raise EOFError('the BGZF file ends inside a block')
+            yield block
+            header = cls.readExactly(fileH, 18)
+
+    @staticmethod
+    def inflateMembers(blocks):
+        ''' Inflate a list of gzip members, such as BGZF blocks, and join them. '''
+        return b''.join(zlib.decompress(block, 31) for block in blocks)
+
+    def inflateBgzf(self, fileH, head):
+        ''' Yield the inflated bytes of a BGZF file, inflating its blocks in parallel.
+
+        The blocks are handed out in tasks of about blockSize inflated
+        bytes and at most twice as many tasks as threads are in flight.
+        zlib lets go of the GIL, so the threads inflate side by side.
+        '''
+        perTask = max(1, self.blockSize >> 16) # a BGZF block holds at most 64 KB
+        with ThreadPoolExecutor(self.threads) as pool:
+            pending = collections.deque()
+            batch = []
+            for block in self.bgzfBlocks(fileH, head):
+                batch.append(block)
+                if len(batch) == perTask:
+                    pending.append(pool.submit(self.inflateMembers, batch))
+                    batch = []
+                while len(pending) > 2 * self.threads:
+                    data = pending.popleft().result()
+                    if data:
+                        yield data
+            if batch:
+                pending.append(pool.submit(self.inflateMembers, batch))
+            while pending:
+                data = pending.popleft().result()
+                if data:
+                    yield data
+
+    def inflateGzip(self, fileH, head):
+        ''' Yield the inflated bytes of a gzip file, inflated by a background thread.
+
+        The thread reads and inflates ahead into a queue of queueSize
+        blocks. A file of several gzip members, as from cat, is read whole.
+        '''
+        blocks = queue.Queue(self.queueSize)
+        stop = threading.Event()
+
+        def put(item):
+            ''' Queue an item unless the reader has stopped. '''
+            while not stop.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def inflate():
+            ''' Inflate the file into the queue, then queue None or the error. '''
+            try:
+                inflater = zlib.decompressobj(31)
+                inMember = False
+                data = head
+                while data and not stop.is_set():
+                    while data:
+                        inMember = True
+                        inflated = inflater.decompress(data)
+                        if inflated:
+                            put(inflated)
+                        data = b''
+                        if inflater.eof:
+                            # the next member starts after the end of this one
+                            data = inflater.unused_data
+                            inflater = zlib.decompressobj(31)
+                            inMember = False
+                    data = fileH.read(self.blockSize)
+                if inMember:
+                    raise EOFError('the gzip file ends inside a member')
+                put(None)
+            except Exception as error:
+                put(error)
+
+        thread = threading.Thread(target=inflate, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = blocks.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
+    def readPieces(self, blocks=None):
+        ''' Yield (record number, header, piece) for the cleaned sequence of each record
+
+        The input is read in large blocks. Each piece of sequence is cleaned
+        with a single bytes.translate, so a record arrives as one or more
+        pieces of at most a block. Every record starts with an empty piece,
+        so records without sequence are still seen. blocks, when given, are
+        parsed in place of the input.
+        '''
+        number = -1
+        header = None # None until the first fasta header
+        headerLine = bytearray()
+        inHeader = False
+        atLineStart = True
+
+        for block in self.readBlocks() if blocks is None else blocks:
+            pos = 0
+            while pos < len(block):
+                if inHeader:
+                    end = block.find(b'\n', pos)
+                    if end < 0:
+                        headerLine += block[pos:]
+                        break
+                    headerLine += block[pos:end]
+                    header = headerLine.decode().rstrip()
+                    number += 1
+                    yield number, header, b''
+                    inHeader, atLineStart = False, True
+                    pos = end + 1
+                elif atLineStart and block.startswith(b'>', pos):
+                    headerLine = bytearray()
+                    inHeader = True
+                    pos += 1
                 else:
-                    sequence += ''.join(line.rstrip().split()).upper()
+                    # sequence runs to the next line that starts a header
+                    end = block.find(b'\n>', pos)
+                    end = len(block) if end < 0 else end + 1
+                    if header is not None:
+                        yield number, header, block[pos:end].translate(self.upperTable, self.whitespace)
+                    atLineStart = block[end - 1] == ord('\n')
+                    pos = end
+
+        if inHeader:
+            yield number + 1, headerLine.decode().rstrip(), b''
+
+    def readFasta(self, blocks=None):
+        ''' Read an entire FastA record and return the sequence header/sequence
+
+        The pieces of a record are added to a bytearray, which is decoded
+        once per record.
+        '''
+        for number, pieces in itertools.groupby(self.readPieces(blocks), key=lambda piece: piece[0]):
+            sequence = bytearray()
+            for number, header, piece in pieces:
+                sequence += piece
+            yield header, sequence.decode()
+
+    def readParallel(self, workers, ordered=True):
+        ''' Read the FastA records as readFasta does, parsing in worker processes.
+
+        The file is cut into byte ranges of at most rangeSize, at least one
+        per worker, and each cut is moved on to the next line that starts a
+        header. Each range is parsed by a worker, and its records come back
+        as a batch: in file order, or as soon as they are done if ordered is
+        False. At most two batches per worker are in flight. Input that
+        cannot be cut into ranges, a pipe or a gzip file, is read by
+        readFasta, as is any input when workers is 1 or less.
+        '''
+        path = self.seekablePath()
+        if workers <= 1 or path is None:
+            yield from self.readFasta()
+            return
+        import multiprocessing
+        start = os.lseek(sys.stdin.fileno(), 0, os.SEEK_CUR) if self.fname == '' else 0
+        mm = FastAreader(path).doMap()
+        size = len(mm)
+        ranges = max(workers, -(-(size - start) // self.rangeSize))
+        cuts = [start]
+        for i in range(1, ranges):
+            cut = start + (size - start) * i // ranges
+            cut = mm.find(b'\n>', max(cut - 1, cuts[-1])) + 1 or size
+            if cut > cuts[-1]:
+                cuts.append(cut)
+        cuts.append(size)
+        tasks = [(path, begin, end) for begin, end in zip(cuts, cuts[1:]) if end > begin]
+
+        finished = queue.Queue()
+        pending = collections.deque()
+
+        def collect():
+            ''' Return the oldest batch, or the first one done when not ordered. '''
+            job = pending.popleft()
+            if ordered:
+                return job.get()
+            batch = finished.get()
+            if isinstance(batch, BaseException):
+                raise batch
+            return batch
+
+        with multiprocessing.Pool(workers) as pool:
+            for task in tasks:
+                if len(pending) >= 2 * workers:
+                    yield from collect()
+                if ordered:
+                    pending.append(pool.apply_async(FastAreader.parseRange, (task,)))
+                else:
+                    pending.append(pool.apply_async(FastAreader.parseRange, (task,),
+                                                    callback=finished.put, error_callback=finished.put))
+            while pending:
+                yield from collect()
+
+    @staticmethod
+    def parseRange(task):
+        ''' Return the records of a (path, start, end) byte range, for readParallel. '''
+        path, start, end = task
+        reader = FastAreader(path)
+        mm = reader.doMap()
+        return list(reader.readFasta(mm[pos:min(pos + reader.blockSize, end)]
+                                     for pos in range(start, end, reader.blockSize)))
+
+    def seekablePath(self):
+        ''' Return a path the input can be mapped from, None for a pipe or gzip input.
+
+        stdin redirected from a file is found through /proc/self/fd.
+        '''
+        path = self.fname
+        if path == '':
+            try:
+                fd = sys.stdin.fileno()
+                path = os.readlink('/proc/self/fd/{}'.format(fd))
+                if not os.path.samestat(os.fstat(fd), os.stat(path)):
+                    return None
+            except (OSError, ValueError, AttributeError):
+                return None
+        if not os.path.isfile(path) or FastAreader(path).compression() is not None:
+            return None
+        return path
+
+    def readWindows(self, size, overlap=0):
+        ''' Yield (header, start, window, last) for overlapping windows of each record
+
+        Windows hold size bases and start every size - overlap bases, so a
+        record is never held in memory as a whole. start is the 0-based
+        position of the window in its record and last marks the final
+        window of a record, which runs to the record end and may be shorter.
+        A window that lies inside one block of input is a memoryview of it,
+        one that spans two blocks is a bytes copy.
+        '''
+        if not 0 <= overlap < size:
+            raise ValueError('overlap must be at least 0 and less than size')
+        for number, pieces in itertools.groupby(self.readPieces(), key=lambda piece: piece[0]):
+            number, header, piece = next(pieces)
+            for start, window, last in self.windowPieces(
+                    (piece for number, header, piece in pieces), size, overlap):
+                yield header, start, window, last
+
+    @staticmethod
+    def windowPieces(pieces, size, overlap=0):
+        ''' Yield (start, window, last) for the windows over consecutive pieces of one sequence.
+
+        A window is only given out once the data reaches past its end, so
+        the window that reaches the end of the sequence is always the last.
+        '''
+        step = size - overlap
+        nextStart = 0 # position of the next window
+        tail = b'' # the sequence from nextStart to the start of piece
+        for piece in pieces:
+            if not piece:
+                continue
+            pieceStart = nextStart + len(tail)
+            pieceEnd = pieceStart + len(piece)
+            while nextStart + size < pieceEnd:
+                if nextStart >= pieceStart:
+                    offset = nextStart - pieceStart
+                    yield nextStart, memoryview(piece)[offset:offset + size], False
+                else:
+                    yield nextStart, tail + piece[:size - len(tail)], False
+                    tail = tail[step:]
+                nextStart += step
+            if nextStart >= pieceStart:
+                tail = piece[nextStart - pieceStart:]
+            else:
+                tail = tail + piece
+        yield nextStart, tail, True
 
-        yield header, sequence
+    def index(self):
+        ''' Return the record index, building the .fai sidecar if it is missing or stale.
+
+        The index maps each record name (the header up to the first space)
+        to (length, offset, lineBases, lineWidth) as in a samtools .fai:
+        the sequence length, the byte offset of its first base, the bases
+        per line and the bytes per line. The sidecar is a plain samtools
+        .fai, and one older than the FastA, or that does not fit it, is
+        rebuilt.
+        The offsets of a BGZF file are in its inflated bytes, as samtools
+        keeps them, and virtualOffset turns them into file positions.
+        '''
+        if self.fname == '':
+            raise ValueError('an index needs a FastA file, not stdin')
+        if self.faIndex is not None:
+            return self.faIndex
+        sidecar = self.fname + '.fai'
+        try:
+            if os.stat(sidecar).st_mtime_ns >= os.stat(self.fname).st_mtime_ns:
+                faIndex = dict()
+                with open(sidecar) as fileH:
+                    for line in fileH:
+                        name, length, offset, lineBases, lineWidth = line.rstrip('\n').split('\t')
+                        faIndex[name] = (int(length), int(offset), int(lineBases), int(lineWidth))
+                if self.indexFits(faIndex):
+                    self.faIndex = faIndex
+                    return self.faIndex
+        except (OSError, ValueError):
+            pass
+        self.faIndex = self.buildIndex()
+        try:
+            with open(sidecar, 'w') as fileH:
+                for name, entry in self.faIndex.items():
+                    fileH.write('\t'.join([name] + [str(value) for value in entry]) + '\n')
+        except OSError:
+            pass # a read only directory still gets an in memory index
+        return self.faIndex
+
+    def indexFits(self, faIndex):
+        ''' Check that every record of an index lies in the file and the last one ends it.
+
+        A FastA replaced by an older file keeps a newer .fai, so the
+        records are checked against the file as well as its mtime.
+        '''
+        size = self.dataSize()
+        if size is None:
+            return False
+        last = 0 # one past the last base of the last record
+        for length, offset, lineBases, lineWidth in faIndex.values():
+            end = offset
+            if length:
+                if lineBases <= 0 or lineWidth < lineBases:
+                    return False
+                lines = (length - 1) // lineBases # whole lines before the last
+                end = offset + lines * lineWidth + length - lines * lineBases
+            if end > size:
+                return False
+            last = max(last, end)
+        # only line ends may follow the last base
+        return size - last <= 1024 and not self.readRange(last, size).strip()
+
+    def buildIndex(self):
+        ''' Scan the FastA file for the offsets and line layout of every record. '''
+        import numpy as np
+        faIndex = dict()
+        kind = self.compression()
+        if kind == 'gzip':
+            raise ValueError('{} is gzip but not BGZF, recompress it with bgzip to index it'.format(self.fname))
+        mm = b''.join(self.readBlocks()) if kind == 'bgzf' else self.doMap()
+        if len(mm) == 0:
+            return faIndex
+        data = np.frombuffer(mm, dtype=np.uint8)
+        ends = np.flatnonzero(data == ord('\n')) + 1 # one past each line
+        if len(ends) == 0 or ends[-1] != len(data):
+            ends = np.append(ends, len(data))
+        starts = np.concatenate(([0], ends[:-1]))
+        widths = ends - starts
+        # bases on a line leave out its line end
+        bases = widths - (data[ends - 1] == ord('\n')) - \
+            ((widths > 1) & (data[np.maximum(ends - 2, 0)] == ord('\r')))
+        headers = np.flatnonzero(data[starts] == ord('>'))
+        for i, line in enumerate(headers.tolist()):
+            last = headers[i + 1] if i + 1 < len(headers) else len(starts)
+            header = bytes(mm[starts[line] + 1:starts[line] + bases[line]]).decode()
+            name = header.split()[0] if header.split() else header
+            lineBases, lineWidth = bases[line + 1:last], widths[line + 1:last]
+            if len(lineBases) == 0:
+                faIndex[name] = (0, int(ends[line]), 0, 0)
+                continue
+            if (len(lineBases) > 1 and ((lineBases[:-1] != lineBases[0]).any() or
+                                        (lineWidth[:-1] != lineWidth[0]).any()
+                                        or lineBases[-1] > lineBases[0])):
+                raise ValueError('record {} has uneven line lengths, it cannot be indexed'.format(name))
+            faIndex[name] = (int(lineBases.sum()), int(starts[line + 1]),
+                             int(lineBases[0]), int(lineWidth[0]))
+        return faIndex
+
+    def compression(self):
+        ''' Return 'bgzf', 'gzip' or None for the compression of the file. '''
+        with open(self.fname, 'rb') as fileH:
+            return self.kindOf(self.readExactly(fileH, 18))
+
+    def dataSize(self):
+        ''' Return the size of the file once inflated, None for gzip that is not BGZF. '''
+        kind = self.compression()
+        if kind is None:
+            return os.stat(self.fname).st_size
+        if kind == 'gzip':
+            return None
+        fileOffsets, inflatedOffsets = self.blockTable()
+        tail = self.tailSize(fileOffsets[-1])
+        return None if tail is None else inflatedOffsets[-1] + tail
+
+    def tailSize(self, fileOffset):
+        ''' Return the inflated size of the BGZF blocks from fileOffset to the end of the file.
+
+        None when the bytes from there are not whole blocks, or there are
+        none: a table offset always starts a block.
+        '''
+        try:
+            with open(self.fname, 'rb') as fileH:
+                fileH.seek(fileOffset)
+                sizes = [int.from_bytes(block[-4:], 'little') for block in self.bgzfBlocks(fileH)]
+        except (ValueError, EOFError):
+            return None
+        return sum(sizes) if sizes else None
+
+    def blockTable(self):
+        ''' Return the file and inflated offsets of the blocks of a BGZF file.
+
+        The table is kept beside the file in the .gzi layout of bgzip -i: a
+        count, then a (file offset, inflated offset) pair of little endian
+        64 bit integers for each block after the first. A .gzi older than
+        the file, or whose last block does not end the file, is rebuilt by
+        reading the block headers and sizes.
+        '''
+        if self.faBlocks is not None:
+            return self.faBlocks
+        sidecar = self.fname + '.gzi'
+        pairs = None
+        try:
+            if os.stat(sidecar).st_mtime_ns >= os.stat(self.fname).st_mtime_ns:
+                with open(sidecar, 'rb') as fileH:
+                    count, = struct.unpack('<Q', fileH.read(8))
+                    pairs = struct.unpack('<{}Q'.format(2 * count), fileH.read(16 * count))
+                if self.tailSize(pairs[-2] if pairs else 0) is None:
+                    pairs = None
+        except (OSError, struct.error):
+            pairs = None
+        if pairs is None:
+            pairs = []
+            fileOffset = inflatedOffset = 0
+            with open(self.fname, 'rb') as fileH:
+                for block in self.bgzfBlocks(fileH):
+                    fileOffset += len(block)
+                    inflatedOffset += int.from_bytes(block[-4:], 'little') # ISIZE
+                    pairs += [fileOffset, inflatedOffset]
+            pairs = pairs[:-2] # nothing starts after the last block
+            try:
+                with open(sidecar, 'wb') as fileH:
+                    fileH.write(struct.pack('<Q{}Q'.format(len(pairs)), len(pairs) // 2, *pairs))
+            except OSError:
+                pass
+        self.faBlocks = ([0] + list(pairs[0::2]), [0] + list(pairs[1::2]))
+        return self.faBlocks
+
+    def virtualOffset(self, offset):
+        ''' Return the BGZF virtual offset of an inflated offset.
+
+        This is the file offset of the block holding it, shifted up 16 bits,
+        plus the offset within the inflated block.
+        '''
+        fileOffsets, inflatedOffsets = self.blockTable()
+        block = bisect.bisect_right(inflatedOffsets, offset) - 1
+        return fileOffsets[block] << 16 | (offset - inflatedOffsets[block])
+
+    def readRange(self, start, end):
+        ''' Return the bytes from start up to end of the file, once inflated.
+
+        A BGZF file inflates only the blocks that hold the range.
+        '''
+        if self.compression() != 'bgzf':
+            return self.doMap()[start:end]
+        if end <= start:
+            return b''
+        fileOffsets, inflatedOffsets = self.blockTable()
+        virtual = self.virtualOffset(start)
+        last = bisect.bisect_right(inflatedOffsets, end - 1)
+        with open(self.fname, 'rb') as fileH:
+            fileH.seek(virtual >> 16)
+            if last < len(fileOffsets):
+                blocks = self.bgzfBlocks(io.BytesIO(fileH.read(fileOffsets[last] - (virtual >> 16))))
+            else:
+                blocks = self.bgzfBlocks(fileH)
+            data = self.inflateMembers(list(blocks))
+        within = virtual & 0xffff
+        return data[within:within + end - start]
+
+    def doMap(self):
+        ''' Memory map the FastA file, once. '''
+        if self.faMap is None:
+            with open(self.fname, 'rb') as fileH:
+                if os.fstat(fileH.fileno()).st_size == 0:
+                    return b''
+                self.faMap = mmap.mmap(fileH.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.faMap
+
+    def fetch(self, region):
+        ''' Return the sequence of a record name, or of a 'name:start-end' slice.
+
+        start and end are 1-based and inclusive, as in samtools faidx. Only
+        the bytes of the slice are read, found from the index with no scan.
+        '''
+        faIndex = self.index()
+        name, start, end = region, 1, None
+        if region not in faIndex and ':' in region:
+            name, span = region.rsplit(':', 1)
+            span = span.replace(',', '')
+            if '-' in span:
+                start, end = span.split('-', 1)
+                start, end = int(start), int(end) if end else None
+            else:
+                start = int(span)
+        if name not in faIndex:
+            raise KeyError(name)
+        length, offset, lineBases, lineWidth = faIndex[name]
+        end = length if end is None else min(end, length)
+        start = max(start, 1) - 1
+        if end <= start:
+            return ''
+
+        def byteOffset(position):
+            ''' File offset of a 0-based position in the record. '''
+            return offset + (position // lineBases) * lineWidth + position % lineBases
+
+        raw = self.readRange(byteOffset(start), byteOffset(end - 1) + 1)
+        return raw.translate(None, b'\r\n').decode().upper()
+
+########################################################################
+# PackedSequence
+########################################################################
+import numpy as np
+
+class PackedSequence:
+    ''' Hold a sequence as 2-bit base codes, four bases to a byte.
+
+    A, C, G and T pack as 0 to 3, the first base in the high bits of its
+    byte. Every other character is also kept in a side table of runs, so
+    the sequence comes back as it was, N runs and IUPAC codes included. A
+    genome takes a quarter of the bytes it does as a str.
+
+    attributes:
+    - length: the number of bases.
+    - packed: uint8 array of the packed base codes.
+    - runStarts, runEnds, runChars: the runs of characters other than
+      ACGT, from start up to end, and the character of each.
+
+    The following functions are included in PackedSequence class:
+    - from_fasta: yield (header, PackedSequence) for each FastA record.
+    - encoded: the base codes, 4 for anything but ACGT.
+    - code: the integer code of the kmer at a position.
+    - kmerCodes: the code of every kmer and whether it is all ACGT.
+    - reverseComplement: the reverse complement as a PackedSequence.
+    - toBytes: the sequence, or a slice of it, as bytes.
+    '''
+    baseCodes = np.full(256, 4, dtype=np.uint8)
+    for code, nuc in enumerate('ACGT'):
+        baseCodes[ord(nuc)] = code
+        baseCodes[ord(nuc.lower())] = code
+    letters = np.frombuffer(b'ACGT', dtype=np.uint8)
+    complements = bytes.maketrans(b'ACGTRYKMBVDHacgtrykmbvdh', b'TGCAYRMKVBHDtgcayrmkvbhd')
+    shifts = np.array([6, 4, 2, 0], dtype=np.uint8)
+
+    def __init__(self, sequence=''):
+        ''' Pack a sequence given as str or bytes. '''
+        if isinstance(sequence, str):
+            sequence = sequence.encode('ascii', 'replace')
+        raw = np.frombuffer(sequence, dtype=np.uint8)
+        codes = self.baseCodes[raw]
+        self.length = len(raw)
+        # lowercase acgt pack as their bases, and are runs so they come back
+        other = np.flatnonzero((codes > 3) | (raw > ord('Z')))
+        chars = raw[other]
+        newRun = np.ones(len(other), dtype=bool)
+        newRun[1:] = (other[1:] != other[:-1] + 1) | (chars[1:] != chars[:-1])
+        first = np.flatnonzero(newRun)
+        self.runStarts = other[first]
+        self.runEnds = np.append(other[first[1:] - 1], other[-1:]) + 1
+        self.runChars = chars[first]
+        self.packed = self.pack(np.where(codes > 3, 0, codes))
+
+    @classmethod
+    def from_fasta(cls, fname=''):
+        ''' Yield (header, PackedSequence) for each record of a FastA file, stdin by default. '''
+        for head, seq in FastAreader(fname).readFasta():
+            yield head, cls(seq)
+
+    @staticmethod
+    def pack(codes):
+        ''' Pack an array of base codes 0 to 3 four to a byte. '''
+        padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+        padded[:len(codes)] = codes
+        quads = padded.reshape(-1, 4)
+        return (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return self.toBytes().decode()
+
+    def __getitem__(self, index):
+        ''' Return a base, or a slice of the sequence, as str. '''
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return str(self)[index]
+            return self.toBytes(start, stop).decode()
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('PackedSequence index out of range')
+        return self.toBytes(index, index + 1).decode()
+
+    def unpack(self, start=0, end=None):
+        ''' Return the packed base codes from start up to end. '''
+        end = self.length if end is None else end
+        if end <= start:
+            return np.zeros(0, dtype=np.uint8)
+        quads = self.packed[start // 4:(end + 3) // 4]
+        codes = ((quads[:, None] >> self.shifts) & 3).ravel()
+        return codes[start % 4:start % 4 + end - start]
+
+    def runPositions(self, start=0, end=None):
+        ''' Return the positions from start up to end held in runs, and their characters. '''
+        end = self.length if end is None else end
+        first = np.searchsorted(self.runEnds, start, side='right')
+        last = np.searchsorted(self.runStarts, end, side='left')
+        starts = np.maximum(self.runStarts[first:last], start)
+        ends = np.minimum(self.runEnds[first:last], end)
+        lengths = ends - starts
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+        return positions, np.repeat(self.runChars[first:last], lengths)
+
+    def toBytes(self, start=0, end=None):
+        ''' Return the sequence from start up to end as bytes. '''
+        end = self.length if end is None else min(end, self.length)
+        if end <= start:
+            return b''
+        text = self.letters[self.unpack(start, end)]
+        positions, chars = self.runPositions(start, end)
+        text[positions - start] = chars
+        return text.tobytes()
+
+    def encoded(self):
+        ''' Return the base codes of the sequence, 4 for anything but ACGT. '''
+        codes = self.unpack()
+        positions, chars = self.runPositions()
+        codes[positions] = self.baseCodes[chars]
+        return codes
+
+    def code(self, i, k):
+        ''' Return the code of the kmer at position i, None if it is not all ACGT.
+
+        Only the bytes holding the kmer are read, whatever the sequence length.
+        '''
+        if i < 0 or i + k > self.length:
+            raise IndexError('kmer past the end of the PackedSequence')
+        run = np.searchsorted(self.runEnds, i, side='right')
+        while run < len(self.runStarts) and self.runStarts[run] < i + k:
+            if self.baseCodes[self.runChars[run]] > 3:
+                return None
+            run += 1
+        last = i + k - 1
+        value = int.from_bytes(self.packed[i // 4:last // 4 + 1].tobytes(), 'big')
+        return (value >> (2 * (3 - last % 4))) & ((1 << (2 * k)) - 1)
+
+    def kmerCodes(self, k):
+        ''' Return the code of every kmer, first base most significant, and whether it is all ACGT. '''
+        encoded = self.encoded()
+        n = len(encoded) - k + 1
+        if n <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+        codes = np.zeros(n, dtype=np.int64)
+        for j in range(k):
+            codes <<= 2
+            codes |= encoded[j:j + n] & 3
+        bad = np.concatenate(([0], np.cumsum(encoded > 3)))
+        return codes, bad[k:] == bad[:n]
+
+    def reverseComplement(self):
+        ''' Return the reverse complement as a new PackedSequence. '''
+        reverse = PackedSequence()
+        reverse.length = self.length
+        reverse.packed = self.pack(3 - self.unpack()[::-1])
+        reverse.runStarts = (self.length - self.runEnds)[::-1]
+        reverse.runEnds = (self.length - self.runStarts)[::-1]
+        chars = self.runChars[::-1].tobytes().translate(self.complements)
+        reverse.runChars = np.frombuffer(chars, dtype=np.uint8).copy()
+        return reverse
 
 ########################################################################
 # RandomizedMotif
@@ -126,14 +902,42 @@ import sys
 import random
 import math
 import copy
+import hashlib
+import time
+import numpy as np
+
+class ProfileMatrix(dict):
+    ''' A profile, a dict of nucleotide to the probability at each position,
+    that also carries the 4 by k matrix of motif base counts it came from. '''
+    def __init__(self, columns, counts):
+        ''' Hold the columns as a dict and keep the counts. '''
+        dict.__init__(self, columns)
+        self.counts = counts
 
 class RandomizedMotif:
-    ''' The following class will find the consensus kmer. '''
-    def __init__(self, DNA, kmer, pseudocount):
+    ''' The following class will find the consensus kmer.
+
+    With --workers or --seed the restarts are independent: each has its
+    own random stream spawned from the seed, keeps its own best, and the
+    restart with the lowest entropy wins, the first one on ties. The
+    result then does not depend on how restarts are spread over workers.
+    With gibbs set, each restart is a Gibbs sampler of that many steps.
+    With a time budget or patience, restarts go on until either runs out.
+    '''
+    worker = None # the RandomizedMotif of a pool worker
+    chunkSize = 16 # restarts per pool task
+    checkpointEvery = 10.0 # least seconds between checkpoints
+    cacheSize = 2**16 # most motif matrices in the restart cache
+    def __init__(self, DNA, kmer, pseudocount, gibbs=None):
         ''' Set up the class for needed action. '''
-        self.DNA = DNA
+        # the sequences are held packed, two bits to a base
+        self.DNA = [seq if isinstance(seq, PackedSequence) else PackedSequence(seq) for seq in DNA]
         self.k = kmer
         self.pseudocounts = pseudocount
+        self.gibbs = gibbs
+        self.restartCache = collections.OrderedDict()
+        self.cacheHits = 0
+        self.cacheMisses = 0
 
         # Place holders for RandomMotifSearch call
         self.MotifMatrix = None
@@ -143,59 +947,320 @@ class RandomizedMotif:
         self.setOfMotifs = {x:[] for x in range(len(DNA))}
 
         for i in self.setOfMotifs:
-            for kmerSeq in range(len(DNA[i]) - self.k + 1):
-                sequence = DNA[i][kmerSeq:kmerSeq + self.k]
+            text = str(self.DNA[i])
+            for kmerSeq in range(len(text) - self.k + 1):
+                sequence = text[kmerSeq:kmerSeq + self.k]
                 self.setOfMotifs[i].append(sequence)
 
-    def RandomMotifSearch(self):
-        ''' Main algorithm to find the consensus Motif. '''
-        self.MotifMatrix = [random.choice(self.setOfMotifs[x]) for x in range(len(self.DNA))]
+        # the bases of every kmer of every sequence, one row per kmer, and
+        # for each sequence the rows of its kmers, padded with a last row
+        # that scores -1 so it is never the best
+        windows = [np.lib.stride_tricks.sliding_window_view(seq.encoded(), self.k)
+                   for seq in self.DNA if len(seq) >= self.k]
+        self.kmerBases = np.concatenate(windows) if windows else np.zeros((0, self.k), dtype=np.uint8)
+        self.kmerCounts = [len(self.setOfMotifs[i]) for i in self.setOfMotifs]
+        self.kmerRows = np.full((len(self.kmerCounts), max(self.kmerCounts, default=0)), len(self.kmerBases))
+        first = 0
+        for i, count in enumerate(self.kmerCounts):
+            self.kmerRows[i, :count] = np.arange(first, first + count)
+            first += count
+        # a base other than ACGT has no profile entry
+        self.badBases = bool((self.kmerBases > 3).any())
+
+        # a profile entry can only be one of len(DNA) + 1 values, the one
+        # Profile adds up to for each count, so its log and its share of
+        # the entropy are looked up by count
+        base = len(self.DNA) + 4 * (self.pseudocounts)
+        values = [self.pseudocounts/base]
+        for count in range(len(self.DNA)):
+            values.append(values[-1] + 1/base)
+        self.probabilities = np.array(values)
+        with np.errstate(divide='ignore'):
+            self.logTable = np.log(self.probabilities) # -inf for a probability of 0
+        self.entropyTable = np.array([-1 *(value*math.log(value, 2)) if value > 0 else 0.0
+                                      for value in values])
+
+    def RandomMotifSearch(self, rng=None):
+        ''' Main algorithm to find the consensus Motif, rng a numpy Generator or random. '''
+        if rng is None:
+            positions = [random.choice(range(len(self.setOfMotifs[x]))) for x in range(len(self.DNA))]
+        else:
+            positions = [rng.integers(len(self.setOfMotifs[x])) for x in range(len(self.DNA))]
+        positions = np.array(positions, dtype=np.int32)
+        self.MotifMatrix = self.motifsAt(positions)
         self.BestMotif = copy.deepcopy(self.MotifMatrix)
 
+        # once the profile of a motif matrix is taken as the best, the rest
+        # of the search depends only on that matrix, so each matrix taken
+        # is cached with its profile entropy and the result it led to, kept
+        # as the motif positions the best profile and best motifs are at
+        taken = []
         while True:
+            key = self.stateKey(self.MotifMatrix)
+            known = self.restartCache.get(key)
+            if known is not None and known[0] < self.entropy(self.BestProfileMatrix):
+                self.cacheHits += 1
+                self.restartCache.move_to_end(key)
+                best = known[1:]
+                self.MotifMatrix = self.motifsAt(best[0])
+                self.BestProfileMatrix = self.Profile()
+                self.BestMotif = self.motifsAt(best[1])
+                break
             self.ProfileMatrix = self.Profile() # get the profile
+            profilePositions = positions
             self.MotifMatrix = self.Motif() # get the matrix from the profile 
-            if self.entropy(self.ProfileMatrix) < self.entropy(self.BestProfileMatrix):
+            positions = self.motifPositions
+            score = self.entropy(self.ProfileMatrix)
+            if score < self.entropy(self.BestProfileMatrix):
+                taken.append((key, score))
+                best = (profilePositions, positions)
                 self.BestMotif = copy.deepcopy(self.MotifMatrix)
                 self.BestProfileMatrix = copy.deepcopy(self.ProfileMatrix)
             else:
-                return copy.deepcopy(self.BestMotif), copy.deepcopy(self.BestProfileMatrix)
+                self.cacheMisses += 1
+                break
+        for key, score in taken:
+            self.restartCache[key] = (score,) + best
+            if len(self.restartCache) > self.cacheSize:
+                self.restartCache.popitem(last=False) # the least recently used
+        return copy.deepcopy(self.BestMotif), copy.deepcopy(self.BestProfileMatrix)
+
+    def motifsAt(self, positions):
+        ''' Return the motif of each sequence at its position, " " for a position of -1. '''
+        return [self.setOfMotifs[i][position] if position >= 0 else " "
+                for i, position in enumerate(positions.tolist())]
+
+    @staticmethod
+    def stateKey(motifs):
+        ''' Hash a motif matrix into a compact cache key. '''
+        return hashlib.blake2b('\n'.join(motifs).encode(), digest_size=16).digest()
+
+    def GibbsSearch(self, rng, steps):
+        ''' Gibbs sampling from random motifs, return the best motifs and profile seen.
+
+        Each step takes out the motif of one sequence and draws its
+        replacement with weights from the profile of the others. The count
+        matrix is kept up to date by taking out and adding back one motif,
+        and the weights of all the kmers of the sequence are found at once.
+        '''
+        n = len(self.DNA)
+        columns = np.arange(self.k)
+        positions = np.array([rng.integers(count) for count in self.kmerCounts])
+        counts = np.zeros((4, self.k), dtype=np.int64)
+        np.add.at(counts, (self.kmerBases[self.kmerRows[np.arange(n), positions]], columns), 1)
+        best = (self.entropy(self.countProfile(counts)), positions.copy())
+
+        for step in range(steps):
+            i = rng.integers(n)
+            counts[self.kmerBases[self.kmerRows[i, positions[i]]], columns] -= 1
+            # the profile of the other motifs, the scale is the same for every kmer
+            profile = (counts + self.pseudocounts) / max(n - 1 + 4 * self.pseudocounts, 1)
+            scores = profile[self.kmerBases[self.kmerRows[i, :self.kmerCounts[i]]], columns].prod(axis=1)
+            total = scores.sum()
+            if total > 0:
+                chosen = np.searchsorted(np.cumsum(scores), rng.random() * total, side='right')
+                positions[i] = min(chosen, self.kmerCounts[i] - 1)
+            else:
+                positions[i] = rng.integers(self.kmerCounts[i])
+            counts[self.kmerBases[self.kmerRows[i, positions[i]]], columns] += 1
+            score = self.entropy(self.countProfile(counts))
+            if score < best[0]:
+                best = (score, positions.copy())
+
+        motifs = [self.setOfMotifs[i][position] for i, position in enumerate(best[1])]
+        counts = np.zeros((4, self.k), dtype=np.int64)
+        np.add.at(counts, (self.kmerBases[self.kmerRows[np.arange(n), best[1]]], columns), 1)
+        return motifs, self.countProfile(counts)
+
+    def countProfile(self, counts):
+        ''' Produce a profile from a 4 by k matrix of motif base counts. '''
+        columns = self.probabilities[counts]
+        return ProfileMatrix({nuc: columns[row].tolist() for row, nuc in enumerate("ACGT")}, counts.copy())
+
+    def restarts(self, seeds):
+        ''' Run an independent restart from each SeedSequence, return their (entropy, motifs, profile). '''
+        results = []
+        for seed in seeds:
+            self.BestMotif = None
+            self.BestProfileMatrix = None
+            if self.gibbs is None:
+                motifs, profile = self.RandomMotifSearch(np.random.default_rng(seed))
+            else:
+                motifs, profile = self.GibbsSearch(np.random.default_rng(seed), self.gibbs)
+            results.append((self.entropy(profile), motifs, profile))
+        return results
+
+    @staticmethod
+    def startWorker(DNA, kmer, pseudocount, gibbs):
+        ''' Set up the RandomizedMotif of a pool worker once. '''
+        RandomizedMotif.worker = RandomizedMotif(DNA, kmer, pseudocount, gibbs)
+
+    @staticmethod
+    def runRestarts(seeds):
+        ''' Run a chunk of restarts in a pool worker, with its cache hits and misses. '''
+        worker = RandomizedMotif.worker
+        hits, misses = worker.cacheHits, worker.cacheMisses
+        results = worker.restarts(seeds)
+        return results, worker.cacheHits - hits, worker.cacheMisses - misses
+
+    def sharedRestarts(self):
+        ''' Yield (entropy, motifs, profile) of RandomMotifSearch restarts that share a best, without end. '''
+        while True:
+            motifs, profile = self.RandomMotifSearch()
+            yield self.entropy(profile), motifs, profile
+
+    def restartStream(self, workers=1, seed=None):
+        ''' Yield (entropy, motifs, profile) of independent restarts in order, without end.
+
+        Restart i draws from the i-th SeedSequence spawned from the seed.
+        With workers, chunks of chunkSize restarts run in a process pool,
+        two chunks per worker in flight, and come back in order.
+        '''
+        root = np.random.SeedSequence(seed)
+        if workers <= 1:
+            while True:
+                yield from self.restarts(root.spawn(1))
+        import multiprocessing
+        import collections
+        with multiprocessing.Pool(workers, initializer=RandomizedMotif.startWorker,
+                                  initargs=(self.DNA, self.k, self.pseudocounts, self.gibbs)) as pool:
+            pending = collections.deque()
+            while True:
+                while len(pending) < 2 * workers:
+                    pending.append(pool.apply_async(RandomizedMotif.runRestarts, (root.spawn(self.chunkSize),)))
+                results, hits, misses = pending.popleft().get()
+                self.cacheHits += hits
+                self.cacheMisses += misses
+                yield from results
+
+    def searchAnytime(self, results, iterations=None, timeBudget=None, patience=None,
+                      checkpoint=None, headers=None):
+        ''' Keep the best of a stream of restart results, return its motifs and profile.
+
+        The search stops after iterations restarts, once timeBudget
+        seconds have passed, or once the best entropy has not improved for
+        patience restarts, whichever comes first. The first of equal
+        entropies is kept. With a checkpoint file, a new best is written
+        to it at most every checkpointEvery seconds, and the final best
+        at the end, so a job that is killed still leaves an answer.
+        '''
+        if iterations is not None and iterations < 1:
+            raise ValueError('no restarts were run')
+        started = time.monotonic()
+        written = None # the time of the last checkpoint
+        best = None
+        unsaved = False
+        sinceBest = 0
+        for done, (score, motifs, profile) in enumerate(results, start=1):
+            if best is None or score < best[0]:
+                best = (score, motifs, profile)
+                unsaved = True
+                sinceBest = 0
+            else:
+                sinceBest += 1
+            now = time.monotonic()
+            if checkpoint and unsaved and (written is None or now - written >= self.checkpointEvery):
+                self.writeCheckpoint(checkpoint, headers, best[1], best[2])
+                written, unsaved = now, False
+            if (iterations is not None and done >= iterations) or \
+               (timeBudget is not None and now - started >= timeBudget) or \
+               (patience is not None and sinceBest >= patience):
+                break
+        if best is None:
+            raise ValueError('no restarts were run')
+        if checkpoint and unsaved:
+            self.writeCheckpoint(checkpoint, headers, best[1], best[2])
+        return best[1], best[2]
+
+    def writeCheckpoint(self, path, headers, motifs, profile):
+        ''' Write a result to path through a temporary file, so the file is always whole. '''
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as fileH:
+            self.report(headers, motifs, profile, fileH)
+        os.replace(temporary, path)
+
+    def report(self, headers, motifs, profile, fileH=None, consensus=None):
+        ''' Print the consensus with its entropy score, then the motif of each sequence. '''
+        fileH = sys.stdout if fileH is None else fileH
+        consensus = self.consensus(profile) if consensus is None else consensus
+        print("{}\tScore: {}".format(consensus, self.entropy(profile)), file=fileH)
+        for motif in range(len(motifs)):
+            print("{}: {}".format(headers[motif], motifs[motif]), file=fileH)
 
     def Profile(self):
-        ''' Produce a profile for the given motif matrix. '''
-        base = len(self.DNA) + 4 * (self.pseudocounts) # base to divide all the counts
-
-        # initalize the profile matrix
-        profileMatrix = {x: [self.pseudocounts/base for y in range(self.k)] for x in "ACGT"}
-
-        # now we count
-        for seq in self.MotifMatrix:
-            indicy = 0
-            for nuc in seq:
-                if nuc in profileMatrix: 
-                    profileMatrix[nuc][indicy] += 1/base
-                    indicy += 1
-        
-        return profileMatrix
+        ''' Produce a profile for the given motif matrix.
+
+        The bases are counted, then each count is looked up in the values
+        that adding 1/base count times to the pseudocount share gives.
+        '''
+        counts = np.zeros((4, self.k), dtype=np.int64)
+        joined = ''.join(self.MotifMatrix)
+        if len(joined) == self.k * len(self.MotifMatrix) and not joined.strip("ACGT"):
+            codes = np.frombuffer(joined.encode(), dtype=np.uint8)
+            codes = PackedSequence.baseCodes[codes].reshape(-1, self.k)
+            np.add.at(counts, (codes, np.arange(self.k)), 1)
+        else:
+            # a motif can be short of k or hold other bases, which are passed over
+            for seq in self.MotifMatrix:
+                indicy = 0
+                for nuc in seq:
+                    if nuc in "ACGT":
+                        counts["ACGT".index(nuc), indicy] += 1
+                        indicy += 1
+        return self.countProfile(counts)
 
     def Motif(self):
-        ''' Find the next set of eligible motifs. '''
+        ''' Find the next set of eligible motifs.
 
-        # initial empty matrix
-        motifMatrix = []
+        Every kmer is scored at once, as the sum of the logs of its
+        probabilities, so long kmers do not underflow. Scores within
+        rounding of the best are then put in order by their product, taken
+        in base order as one kmer at a time would be, so the first highest
+        score is chosen as before wherever the product does not underflow.
+        '''
+        if self.badBases:
+            raise KeyError('a kmer holds a base other than ACGT')
+        counts = getattr(self.ProfileMatrix, 'counts', None)
+        if counts is not None:
+            profile, logs = self.probabilities[counts], self.logTable[counts]
+        else:
+            profile = np.array([self.ProfileMatrix[nuc] for nuc in "ACGT"], dtype=float).reshape(4, self.k)
+            with np.errstate(divide='ignore'):
+                logs = np.log(profile)
+        scores = np.zeros(len(self.kmerBases) + 1)
+        scores[-1] = -np.inf # the padding row
+        for j in range(self.k):
+            scores[:-1] += logs[self.kmerBases[:, j], j]
+        if not len(self.DNA) or not self.kmerRows.size:
+            self.motifPositions = np.full(len(self.DNA), -1, dtype=np.int32)
+            return [" " for i in range(len(self.DNA))]
+
+        # the kmers of each sequence that score within rounding of its best
+        byRow = scores[self.kmerRows]
+        best = np.argmax(byRow, axis=1)
+        top = byRow[np.arange(len(self.DNA)), best]
+        scored = np.isfinite(top)
+        near = (byRow >= (top - 1e-9 * (np.abs(top) + 1))[:, None]) & scored[:, None]
+        sequence, position = np.nonzero(near)
+        products = np.ones(len(sequence))
+        for j in range(self.k):
+            products *= profile[self.kmerBases[self.kmerRows[sequence, position], j], j]
+        order = np.lexsort((position, -products, sequence))
+        first = order[np.flatnonzero(np.diff(sequence[order], prepend=-1))]
+        chosen = best.copy()
+        positive = products[first] > 0
+        chosen[sequence[first[positive]]] = position[first[positive]]
+
+        self.motifPositions = np.where(scored, chosen, -1).astype(np.int32)
 
-        # have an inital max score and after each sequence
-        # chose the kmer with highest score and add to motif
+        # chose the kmer with highest score for each sequence, none when all score 0
+        motifMatrix = []
         for i in range(len(self.DNA)):
-            maxScore = (" ", 0)
-            for motif in self.setOfMotifs[i]:
-                score = 1
-                for nuc in range(len(motif)): 
-                    score *= self.ProfileMatrix[motif[nuc]][nuc]
-                if score > maxScore[1]: 
-                    maxScore = (motif, score)
-            motifMatrix.append(maxScore[0])
-        
+            if scored[i]:
+                motifMatrix.append(self.setOfMotifs[i][chosen[i]])
+            else:
+                motifMatrix.append(" ")
+
         return motifMatrix
 
     def entropy(self, matrix):
@@ -203,6 +1268,10 @@ class RandomizedMotif:
 
         # for the case when the None matrix is called
         if matrix is None: return 10000
+        counts = getattr(matrix, 'counts', None)
+        if counts is not None:
+            # the share of each entry by count, added up a column at a time
+            return float(np.cumsum(self.entropyTable[counts].sum(axis=0))[-1])
         else:
             # adding scores by indicy postion of the profile matrix
             score = 0
@@ -231,6 +1300,178 @@ class RandomizedMotif:
             sequence += bestNuc
         return sequence         
 
+########################################################################
+# MedianString
+########################################################################
+
+class MedianString:
+    ''' Find the median string, the kmer with the least total distance to
+    the sequences, exactly.
+
+    The distance of a pattern to a sequence is the least Hamming distance
+    to any of its kmers. Patterns are built a base at a time, A before C
+    before G before T, so in the order of their 2-bit codes, and a prefix
+    is passed over once its distance over its first bases already reaches
+    the best found: adding bases can only add distance. The partial
+    distances of every kmer are kept in one array and grow by one
+    comparison per base. Of equal patterns the first in that order is kept.
+
+    attributes:
+    - k: the pattern length.
+    - kmerBases: the bases of every kmer of every sequence, one row each.
+    - starts: the first row of each sequence.
+    - nodes: the number of prefixes looked at by the last search.
+
+    The following functions are included in MedianString class:
+    - distances: the distance of every pattern that extends a prefix.
+    - search: the median string, its distance and the closest kmers.
+    '''
+    def __init__(self, DNA, kmer):
+        ''' Set up the kmers of the sequences, each needs one. '''
+        self.k = kmer
+        DNA = [seq if isinstance(seq, PackedSequence) else PackedSequence(seq) for seq in DNA]
+        if not DNA or min(len(seq) for seq in DNA) < self.k:
+            raise ValueError('every sequence needs a kmer of length {}'.format(self.k))
+        windows = [np.lib.stride_tricks.sliding_window_view(seq.encoded(), self.k) for seq in DNA]
+        self.kmerBases = np.concatenate(windows)
+        self.starts = np.cumsum([0] + [len(window) for window in windows[:-1]])
+        self.texts = [str(seq) for seq in DNA]
+        self.nodes = 0
+
+    def distances(self, partial):
+        ''' Return the distance to the sequences of each row of partial kmer distances. '''
+        return np.minimum.reduceat(partial, self.starts, axis=-1).sum(axis=-1)
+
+    def search(self):
+        ''' Return the median string, its total distance and the first closest kmer of each sequence. '''
+        self.nodes = 0
+        bases = np.arange(4, dtype=np.uint8)[:, None]
+        # the first kmer gives a bound to start from, one more so it can still be found
+        first = (self.kmerBases != self.kmerBases[0]).sum(axis=1, dtype=np.int16)
+        best = [int(self.distances(first)) + 1, None, None]
+        # each entry is a prefix: its length, code, distance and partial kmer distances
+        stack = [(0, 0, 0, np.zeros(len(self.kmerBases), dtype=np.int16))]
+        while stack:
+            depth, code, total, partial = stack.pop()
+            if total >= best[0]:
+                continue
+            extended = partial + (self.kmerBases[:, depth] != bases)
+            totals = self.distances(extended)
+            self.nodes += 4
+            if depth + 1 == self.k:
+                for base in range(4):
+                    if totals[base] < best[0]:
+                        best = [int(totals[base]), (code << 2) | base, extended[base]]
+            else:
+                # pushed in reverse so the A prefix comes off the stack first
+                for base in range(3, -1, -1):
+                    if totals[base] < best[0]:
+                        stack.append((depth + 1, (code << 2) | base, totals[base], extended[base]))
+        distance, code, partial = best
+        pattern = ''.join("ACGT"[(code >> (2 * (self.k - 1 - j))) & 3] for j in range(self.k))
+        ends = np.append(self.starts[1:], len(partial))
+        motifs = []
+        for i, (start, end) in enumerate(zip(self.starts, ends)):
+            position = int(np.argmin(partial[start:end]))
+            motifs.append(self.texts[i][position:position + self.k])
+        return pattern, distance, motifs
+
+########################################################################
+# ProfileScan
+########################################################################
+
+class ProfileScan:
+    ''' Scan a genome for the kmers a profile scores well, on both strands.
+
+    A kmer scores the log-odds of the profile against an even background,
+    the sum over its positions of log2(p / 0.25), in bits. The dot product
+    of a window's one-hot bases with the matrix is taken as a lookup of
+    each base's row, a column at a time, so every kmer of a window is
+    scored in k numpy passes. The reverse strand is scored over the same
+    window with the reverse complement of the matrix. A kmer with a base
+    other than ACGT, or a base of probability 0, scores -inf. The genome is
+    read in windows that overlap by k - 1 bases, so each kmer is scored once.
+
+    attributes:
+    - k: the motif length.
+    - forward: the 5 by k log-odds matrix, the last row for other bases.
+    - reverse: the matrix for the reverse strand.
+    - threshold: the least score of a hit, by default 80% of the best score.
+
+    The following functions are included in ProfileScan class:
+    - readProfile: read a profile written by writeProfile.
+    - writeProfile: write a profile, a line of probabilities per nucleotide.
+    - scores: the forward and reverse score of every kmer of coded bases.
+    - scan: the hits in each record of a FASTA file.
+    '''
+    windowSize = 2**20 # kmers scored per window
+    background = 0.25
+    complement = bytes.maketrans(b'ACGTacgt', b'TGCAtgca')
+    def __init__(self, profile, threshold=None):
+        ''' Set up the log-odds matrices of a profile. '''
+        probabilities = np.array([profile[nuc] for nuc in "ACGT"], dtype=float)
+        self.k = probabilities.shape[1]
+        self.forward = np.full((5, self.k), -np.inf)
+        with np.errstate(divide='ignore'):
+            self.forward[:4] = np.log2(probabilities / self.background)
+        self.reverse = np.full((5, self.k), -np.inf)
+        self.reverse[:4] = self.forward[3::-1, ::-1]
+        if threshold is None:
+            threshold = 0.8 * self.forward[:4].max(axis=0).sum()
+        self.threshold = threshold
+
+    @staticmethod
+    def readProfile(path):
+        ''' Return the profile in path, as a dict of nucleotide to probabilities. '''
+        profile = dict()
+        with open(path) as fileH:
+            for line in fileH:
+                fields = line.split()
+                if fields and not fields[0].startswith('#'):
+                    profile[fields[0]] = [float(value) for value in fields[1:]]
+        if sorted(profile) != list("ACGT") or len({len(profile[nuc]) for nuc in profile}) != 1:
+            raise ValueError('a profile needs one line of the same length for each of A, C, G and T')
+        return profile
+
+    @staticmethod
+    def writeProfile(path, profile):
+        ''' Write each nucleotide and its probabilities on a line, tab separated. '''
+        with open(path, 'w') as fileH:
+            for nuc in "ACGT":
+                print("\t".join([nuc] + [repr(float(value)) for value in profile[nuc]]), file=fileH)
+
+    def scores(self, codes):
+        ''' Return the forward and reverse score of every kmer of the coded bases. '''
+        count = len(codes) - self.k + 1
+        forward = np.zeros(count)
+        reverse = np.zeros(count)
+        for j in range(self.k):
+            forward += self.forward[codes[j:j + count], j]
+            reverse += self.reverse[codes[j:j + count], j]
+        return forward, reverse
+
+    def scan(self, fname=''):
+        ''' Yield (name, start, end, strand, score, kmer) for each hit, in order.
+
+        start and end are 0-based and end exclusive, and kmer is read on
+        the strand of the hit.
+        '''
+        windows = FastAreader(fname).readWindows(self.windowSize + self.k - 1, self.k - 1)
+        for header, start, window, last in windows:
+            if len(window) < self.k:
+                continue
+            name = header.split()[0] if header.split() else header
+            codes = PackedSequence.baseCodes[np.frombuffer(window, dtype=np.uint8)]
+            forward, reverse = self.scores(codes)
+            for position in np.flatnonzero((forward >= self.threshold) | (reverse >= self.threshold)):
+                kmer = bytes(window[position:position + self.k])
+                for strand, scores in (('+', forward), ('-', reverse)):
+                    if scores[position] >= self.threshold:
+                        if strand == '-':
+                            kmer = kmer.translate(self.complement)[::-1]
+                        yield (name, start + int(position), start + int(position) + self.k,
+                               strand, float(scores[position]), kmer.decode())
+
 ########################################################################
 # Main
 ########################################################################
@@ -245,36 +1486,61 @@ def main(myCommandLine=None):
     else :
         command = CommandLine(myCommandLine) # interpret the list passed from the caller of main as the commandline.
     try:
-        DNA = [] #an array of all the sequences in the fasta file.
-        headers = []
-        N = 0 # the len of each sequence.
-        for head, seq in FastAreader().readFasta():
-            DNA.append(seq.upper())
-            pieces = head.split()
-            headers.append(pieces[0])
-
-        # set up for printing.
-        M = RandomizedMotif(DNA, command.args.motifLength, command.args.psuedocounts)
-        # feeds the commandline options to the Genome class
-
-        # initalize -i and holder values for BestProfile and BestMotif
-        iterations = command.args.iterations
-        BestMotif = None
-        BestProfile = None
-
-        while iterations > 0:
-            MotifMatrix, ProfileMatrix = M.RandomMotifSearch()
-            if BestMotif is None or M.entropy(ProfileMatrix) < M.entropy(BestProfile):
-                BestMotif = copy.deepcopy(MotifMatrix)
-                BestProfile = copy.deepcopy(ProfileMatrix)
-            iterations-=1
-
-        # Now we print the output
-        # first is the concensus sequence. with its entropy score.
-        print("{}\tScore: {}".format(M.consensus(BestProfile), M.entropy(BestProfile)))
-        # print each of the bestMotif's per string.
-        for motif in range(len(BestMotif)):
-            print("{}: {}".format(headers[motif], BestMotif[motif]))
+        if command.args.profile is not None:
+            # a saved profile is scanned without searching again
+            BestProfile = ProfileScan.readProfile(command.args.profile)
+        else:
+            DNA = [] #an array of all the sequences in the fasta file.
+            headers = []
+            N = 0 # the len of each sequence.
+            for head, seq in FastAreader().readFasta():
+                DNA.append(PackedSequence(seq.upper()))
+                pieces = head.split()
+                headers.append(pieces[0])
+
+            # set up for printing.
+            M = RandomizedMotif(DNA, command.args.motifLength, command.args.psuedocounts, command.args.gibbs)
+            # feeds the commandline options to the Genome class
+
+            k = command.args.motifLength
+            if command.args.exact or 4**k * len(M.kmerBases) <= command.args.exactLimit:
+                # the exact median string, reported as the consensus of its closest kmers
+                median = MedianString(DNA, k)
+                consensus, distance, BestMotif = median.search()
+                M.MotifMatrix = BestMotif
+                BestProfile = M.Profile()
+                M.report(headers, BestMotif, BestProfile, consensus=consensus)
+                print("median string: distance {}, {} of {} prefixes looked at".format(
+                    distance, median.nodes, sum(4**depth for depth in range(1, k + 1))), file=sys.stderr)
+            else:
+                # initalize -i, or no limit when a time budget or patience stops the search
+                iterations = command.args.iterations
+                if command.args.timeBudget is not None or command.args.patience is not None:
+                    iterations = None
+
+                if command.args.workers is not None or command.args.seed is not None or command.args.gibbs is not None:
+                    # independent restarts, the same result for a seed on any number of workers
+                    results = M.restartStream(command.args.workers or 1, command.args.seed)
+                else:
+                    results = M.sharedRestarts()
+                BestMotif, BestProfile = M.searchAnytime(results, iterations, command.args.timeBudget,
+                                                         command.args.patience, command.args.checkpoint, headers)
+                results.close()
+
+                # Now we print the output
+                # first is the concensus sequence. with its entropy score.
+                # print each of the bestMotif's per string.
+                M.report(headers, BestMotif, BestProfile)
+                if command.args.gibbs is None:
+                    print("restart cache: {} hits, {} misses".format(M.cacheHits, M.cacheMisses), file=sys.stderr)
+            if command.args.saveProfile is not None:
+                ProfileScan.writeProfile(command.args.saveProfile, BestProfile)
+
+        # then the hits of the profile in the genome, one per line
+        if command.args.scan is not None:
+            scanner = ProfileScan(BestProfile, command.args.threshold)
+            for hit in scanner.scan(command.args.scan):
+                print("{}\t{}\t{}\t{}\t{:.3f}\t{}".format(*hit))
 
     except:
         raise Usage("Usage: randomizedMotifSearch.py [options] <infile >outfile")